@@ -0,0 +1,225 @@
+"""
+space_kokaton.pyのバッチシミュレーター
+乱数の種と入力の方針（ポリシー）を決めたゲームを，プロセスプールで画面を出さずに大量に動かし，
+生存時間，スコアの推移，ゲームオーバーの原因，fpsを集計する
+--ruleでしきい値（DEFAULT_RULES）を複数指定すると，すべての組み合わせを比べられる
+
+使い方（ゲームと同じく ex05 の親ディレクトリで実行する）：
+    python ex05/batch_kokaton.py -n 1000                           # 1000ゲームをCPUの数だけ並列に動かす
+    python ex05/batch_kokaton.py -n 500 -p dodge                   # よける動きをする入力で動かす
+    python ex05/batch_kokaton.py -n 200 --rule hp_max=3,4,5 --rule fire_score=50,80
+    python ex05/batch_kokaton.py -n 1000 --json result.json --csv games.csv
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame as pg
+
+import space_kokaton as sk
+
+
+CURVE_STEP = sk.SIM_FPS  # スコアを記録する間隔（ステップ，1秒ごと）
+
+
+def idle_policy(game: sk.Game, rng: random.Random) -> sk.FrameInput:
+    """
+    何も操作しない
+    """
+    return sk.FrameInput({k: False for k in sk.Bird.delta}, [])
+
+
+def random_policy(game: sk.Game, rng: random.Random) -> sk.FrameInput:
+    """
+    乱数で操作する（run_headlessと同じ入力）
+    """
+    return sk.random_input(rng)
+
+
+def dodge_policy(game: sk.Game, rng: random.Random) -> sk.FrameInput:
+    """
+    いちばん近い爆弾か敵機から離れるように動き，定期的にビームを撃つ
+    焼野原がついたら画面の下半分には入らない
+    """
+    bird = game.bird.rect
+    keys = {k: False for k in sk.Bird.delta}
+    near = min([*game.bombs, *game.emys], default=None,
+               key=lambda b: (b.rect.centerx-bird.centerx)**2+(b.rect.centery-bird.centery)**2)
+    if near is not None and (near.rect.centerx-bird.centerx)**2+(near.rect.centery-bird.centery)**2 < 200**2:
+        keys[pg.K_LEFT if near.rect.centerx > bird.centerx else pg.K_RIGHT] = True
+        keys[pg.K_UP if near.rect.centery > bird.centery else pg.K_DOWN] = True
+    elif game.emys:  # 近くに爆弾も敵機もなければ，いちばん近い敵機の真下に向かう
+        emy = min(game.emys, key=lambda e: abs(e.rect.centerx-bird.centerx))
+        if abs(emy.rect.centerx-bird.centerx) > 20:
+            keys[pg.K_RIGHT if emy.rect.centerx > bird.centerx else pg.K_LEFT] = True
+        elif bird.centery > emy.rect.bottom+250 or game.bird.dire != (0, -1):
+            keys[pg.K_UP] = True  # 上を向いて近づく
+    if game.fires and bird.bottom >= sk.HEIGHT//2-game.bird.speed:
+        keys[pg.K_DOWN] = False
+    events = [(pg.KEYDOWN, pg.K_SPACE)] if game.tmr % 25 == 0 else []
+    return sk.FrameInput(keys, events)
+
+
+POLICIES = {  # ポリシー名をキーとした，(Game, 乱数生成器)から1ステップ分の入力を返す関数
+    "idle": idle_policy,
+    "random": random_policy,
+    "dodge": dodge_policy,
+}
+
+
+def init_worker():
+    """
+    ワーカープロセスごとに一度だけpygameを初期化する
+    """
+    pg.init()
+
+
+def run_game(task: tuple[int, str, dict[str, int], int]) -> dict:
+    """
+    ゲームを1回，終わるか最大ステップ数に達するまで動かす（ワーカープロセスで実行する）
+    引数 task：(乱数の種, ポリシー名, しきい値, 最大ステップ数)
+    戻り値：結果の辞書
+    """
+    seed, policy, rules, max_steps = task
+    game = sk.Game(seed, rules=rules, effects=False)  # 描画しないので爆発エフェクトは出さない
+    rng = random.Random(seed)  # 入力用の乱数（ゲームの乱数とは別）
+    make_input = POLICIES[policy]
+    curve = []
+    start = time.perf_counter()
+    while game.state == "playing" and game.tmr < max_steps:
+        if game.tmr % CURVE_STEP == 0:
+            curve.append(game.score.score)
+        game.step(make_input(game, rng))
+    elapsed = time.perf_counter()-start
+    return {
+        "seed": seed,
+        "steps": game.tmr,
+        "seconds": game.tmr/sk.SIM_FPS,
+        "state": game.state,
+        "cause": game.cause if game.state == "over" else ("clear" if game.state == "clear" else "timeout"),
+        "score": game.score.score,
+        "hp": game.hp.hp,
+        "curve": curve,
+        "fps": game.tmr/elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values)*q), len(values)-1)]
+
+
+def summarize(results: list[dict]) -> dict:
+    """
+    同じ設定で動かしたゲームの結果を集計する
+    引数 results：run_gameの結果のリスト
+    戻り値：生存時間，スコア，原因別の数，スコアの推移（1秒ごとの平均）などの辞書
+    """
+    seconds = [res["seconds"] for res in results]
+    scores = [res["score"] for res in results]
+    causes = {}
+    for res in results:
+        causes[res["cause"]] = causes.get(res["cause"], 0)+1
+    length = max(len(res["curve"]) for res in results)
+    curve = []  # 終わったゲームは最後のスコアのままとして平均する
+    for i in range(length):
+        curve.append(statistics.fmean(res["curve"][min(i, len(res["curve"])-1)] if res["curve"] else 0 for res in results))
+    return {
+        "games": len(results),
+        "survival_mean": statistics.fmean(seconds),
+        "survival_p10": percentile(seconds, 0.1),
+        "survival_p50": percentile(seconds, 0.5),
+        "survival_p90": percentile(seconds, 0.9),
+        "score_mean": statistics.fmean(scores),
+        "score_max": max(scores),
+        "clear_rate": causes.get("clear", 0)/len(results),
+        "causes": causes,
+        "curve": curve,
+        "fps_mean": statistics.fmean(res["fps"] for res in results),
+    }
+
+
+def parse_rule(items: list[str], parser: argparse.ArgumentParser) -> list[dict[str, int]]:
+    """
+    --ruleの指定から，しきい値のすべての組み合わせを作る
+    引数1 items：NAME=V1,V2,...の文字列のリスト
+    引数2 parser：エラーを表示するArgumentParser
+    戻り値：しきい値の辞書のリスト（指定がなければ既定値1つ）
+    """
+    names, values = [], []
+    for item in items:
+        name, _, vals = item.partition("=")
+        if name not in sk.DEFAULT_RULES:
+            parser.error(f"--rule の名前が正しくありません：{name}（{', '.join(sk.DEFAULT_RULES)}）")
+        try:
+            values.append([int(v) for v in vals.split(",")])
+        except ValueError:
+            parser.error(f"--rule の値が正しくありません：{item}")
+        names.append(name)
+    return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="逆襲！エイリアン バッチシミュレーター")
+    parser.add_argument("-n", "--games", type=int, default=100, help="設定ごとに動かすゲームの数")
+    parser.add_argument("-p", "--policy", choices=list(POLICIES), default="random", help="入力の方針")
+    parser.add_argument("--seed", type=int, default=0, help="最初のゲームの乱数の種（以降は1ずつ増やす）")
+    parser.add_argument("--max-steps", type=int, default=sk.SIM_FPS*300, help="1ゲームの最大ステップ数")
+    parser.add_argument("--rule", action="append", default=[], metavar="NAME=V1,V2,...",
+                        help=f"しきい値を変える（NAMEは{', '.join(sk.DEFAULT_RULES)}，複数の値ですべての組み合わせを比べる）")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="ワーカープロセスの数")
+    parser.add_argument("--json", default=None, metavar="PATH", help="集計結果をJSONで書き出す")
+    parser.add_argument("--csv", default=None, metavar="PATH", help="ゲームごとの結果をCSVで書き出す")
+    args = parser.parse_args()
+    if args.games < 1:
+        parser.error("--games には1以上を指定してください")
+    if args.jobs < 1:
+        parser.error("--jobs には1以上を指定してください")
+    rule_sets = parse_rule(args.rule, parser)
+
+    tasks = [(args.seed+i, args.policy, rules, args.max_steps) for rules in rule_sets for i in range(args.games)]
+    chunksize = max(1, len(tasks)//(args.jobs*8))  # ワーカーとのやりとりを減らしつつ，終わりの待ちを短くする
+    start = time.perf_counter()
+    with ProcessPoolExecutor(args.jobs, initializer=init_worker) as pool:
+        results = list(pool.map(run_game, tasks, chunksize=chunksize))
+    elapsed = time.perf_counter()-start
+
+    summaries = []
+    for i, rules in enumerate(rule_sets):
+        summary = summarize(results[i*args.games:(i+1)*args.games])
+        summary["rules"] = dict(sk.DEFAULT_RULES, **rules)
+        summaries.append(summary)
+        label = " ".join(f"{k}={v}" for k, v in rules.items()) or "default"
+        causes = " ".join(f"{k}:{v}" for k, v in sorted(summary["causes"].items()))
+        print(f"{label:>30}: survival mean {summary['survival_mean']:6.1f}s p50 {summary['survival_p50']:6.1f}s  "
+              f"score mean {summary['score_mean']:6.1f}  clear {summary['clear_rate']:5.1%}  [{causes}]")
+    steps = sum(res["steps"] for res in results)
+    print(f"{len(results)} games, {steps} steps in {elapsed:.1f}s with {args.jobs} workers "
+          f"({steps/elapsed:.0f} steps/s, {statistics.fmean(res['fps'] for res in results):.0f} fps per game)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"policy": args.policy, "elapsed": elapsed, "jobs": args.jobs, "summaries": summaries}, f, indent=2)
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["seed", *sk.DEFAULT_RULES, "steps", "cause", "score", "hp", "fps"])
+            for i, res in enumerate(results):
+                rules = dict(sk.DEFAULT_RULES, **rule_sets[i//args.games])
+                writer.writerow([res["seed"], *rules.values(), res["steps"], res["cause"], res["score"], res["hp"],
+                                 f"{res['fps']:.1f}"])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,414 @@
+"""
+space_kokaton.pyのベンチマーク
+SDLのダミードライバで，名前付きのシナリオを決まったフレーム数だけ動かし，
+fps，1フレームの処理時間のパーセンタイル，最大メモリ使用量を表示する
+保存しておいた基準値（ベースライン）と比べて，遅くなったシナリオを検出できる
+
+使い方（ゲームと同じく ex05 の親ディレクトリで実行する）：
+    python ex05/bench_kokaton.py                       # すべてのシナリオを実行
+    python ex05/bench_kokaton.py -s neobeam_burst      # シナリオを指定
+    python ex05/bench_kokaton.py --save-baseline       # 結果を基準値として保存
+    python ex05/bench_kokaton.py --check               # 基準値と比べ，遅くなっていれば終了コード1
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import traceback
+from types import SimpleNamespace
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+try:
+    import resource
+except ImportError:  # Windowsではresourceがないので最大メモリ使用量は測らない
+    resource = None
+
+import pygame as pg
+
+import space_kokaton as sk
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")  # 基準値のファイル
+SAFE_X = range(650, 951)  # こうかとんのいる列（敵機を置かない範囲）
+
+
+def no_input() -> sk.FrameInput:
+    """
+    何も押していない入力を返す
+    """
+    return sk.FrameInput({k: False for k in sk.Bird.delta}, [])
+
+
+def make_safe(game: sk.Game):
+    """
+    ベンチマーク中にゲームオーバーにならないよう，HPを増やしてこうかとんを画面上端に置く
+    （敵機は自動では出現させず，シナリオでSAFE_X以外の場所に置く）
+    引数 game：準備するGame
+    """
+    game.hp.max = game.hp.hp = 10**6
+    game.bird.rect.center = 800, 40
+    game.caps["emys"] = 0
+
+
+def place_enemies(game: sk.Game, num: int, interval: tuple[int, int] = (20, 60)):
+    """
+    停止状態の敵機をnum機並べる
+    引数1 game：Game
+    引数2 num：敵機の数
+    引数3 interval：爆弾投下インターバルの範囲
+    """
+    xs = [x for x in range(40, sk.WIDTH-40, 60) if x not in SAFE_X]
+    for i in range(num):
+        emy = sk.Enemy(game.rng)
+        emy.rect.center = xs[i % len(xs)], game.rng.randint(150, 400)
+        emy.bound = emy.rect.centery
+        emy.vy = 0
+        emy.state = "stop"
+        emy.interval = game.rng.randint(*interval)
+        game.add_enemy(emy)
+
+
+def setup_stopped_enemies(game: sk.Game):
+    make_safe(game)
+    game.caps["bombs"] = 1000
+    place_enemies(game, 20)
+
+
+def setup_neobeam_burst(game: sk.Game):
+    make_safe(game)
+    game.caps["beams"] = 1000
+    game.bird.dire = (0, +1)  # 下向きに撃つ
+    place_enemies(game, 10, (50, 300))
+
+
+def input_neobeam_burst(game: sk.Game, frame: int) -> sk.FrameInput:
+    """
+    毎フレーム，左シフト＋スペースで弾幕を撃つ（リロード待ちは解除する）
+    """
+    game.re = 0
+    return sk.FrameInput({k: False for k in sk.Bird.delta}, [(pg.KEYDOWN, pg.K_SPACE)], pg.KMOD_LSHIFT)
+
+
+def setup_shields_gravity(game: sk.Game):
+    make_safe(game)
+    game.caps["bombs"] = 1000
+    place_enemies(game, 20)
+    for x in (200, 600, 1000, 1400):
+        gravity = sk.Gravity(game.bird, 200, 10**9)
+        gravity.rect.center = x, 650
+        game.gravity.add(gravity)
+    for x in range(100, sk.WIDTH, 200):
+        shield = sk.Shield(game.bird, 10**9)
+        shield.rect.center = x, 500
+        game.Shields.add(shield)
+
+
+def setup_fire_overlay(game: sk.Game):
+    make_safe(game)
+    place_enemies(game, 10)
+    game.score.score = 60  # 50点以上で焼野原がつく
+
+
+def setup_explosions(game: sk.Game):
+    make_safe(game)
+    game.caps["exps"] = 1000
+
+
+def input_explosions(game: sk.Game, frame: int) -> sk.FrameInput:
+    """
+    毎フレーム爆発エフェクトを追加し，数百個の爆発が同時に出ている状態を保つ
+    """
+    for _ in range(10):
+        spot = SimpleNamespace(rect=pg.Rect(game.rng.randint(0, sk.WIDTH), game.rng.randint(0, sk.HEIGHT), 0, 0))
+        game.add_exp(spot, 50)
+    return no_input()
+
+
+SCENARIOS = {  # シナリオ名をキーとした(準備する関数, 毎フレームの入力を返す関数)
+    "stopped_enemies": (setup_stopped_enemies, None),
+    "neobeam_burst": (setup_neobeam_burst, input_neobeam_burst),
+    "shields_gravity": (setup_shields_gravity, None),
+    "fire_overlay": (setup_fire_overlay, None),
+    "explosions": (setup_explosions, input_explosions),
+}
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values)*q), len(values)-1)]
+
+
+def peak_memory_mb() -> float | None:
+    """
+    このプロセスの最大メモリ使用量（MB）を返す
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/2**20 if sys.platform == "darwin" else peak/2**10  # macOSはバイト，Linuxはキロバイト
+
+
+def run_scenario(name: str, frames: int, seed: int, numpy_engine: bool, dirty: bool, render_scale: float = 1.0,
+                 scale_mode: str = "nearest", quality: int = 0) -> dict:
+    """
+    シナリオを1つ実行して結果を返す
+    引数1 name：シナリオ名
+    引数2 frames：動かすフレーム数
+    引数3 seed：乱数の種
+    引数4 numpy_engine：ProjectileEngineを使うかどうか
+    引数5 dirty：変化した領域だけを描き直すモードで描画するかどうか
+    引数6 render_scale：内部解像度の画面に対する割合
+    引数7 scale_mode：内部解像度から画面への拡大のしかた
+    引数8 quality：固定する画質レベル
+    戻り値：fps，処理時間のパーセンタイル（ミリ秒），最大メモリ使用量（MB）などの辞書
+    """
+    pg.init()
+    screen = pg.display.set_mode((sk.WIDTH, sk.HEIGHT))
+    sk.normalize_assets()
+    sk.prebake_imgs()
+    renderer = sk.Renderer(screen, sk.load_img("pg_bg.jpg"), dirty, render_scale, scale_mode)
+    game = sk.Game(seed, numpy_engine)
+    setup, make_input = SCENARIOS[name]
+    setup(game)
+    sk.QualityGovernor(fixed=quality).apply(game, renderer)
+    times = []
+    start = time.perf_counter()
+    for frame in range(frames):
+        t0 = time.perf_counter()
+        inp = make_input(game, frame) if make_input else no_input()
+        game.step(inp)
+        renderer.draw(game)
+        times.append((time.perf_counter()-t0)*1000)
+        if game.state != "playing":
+            raise RuntimeError(f"{name}：{frame}フレーム目でゲームが終わりました（{game.state}）")
+    elapsed = time.perf_counter()-start
+    pg.quit()
+    return {
+        "frames": frames,
+        "fps": frames/elapsed,
+        "p50": percentile(times, 0.5),
+        "p95": percentile(times, 0.95),
+        "p99": percentile(times, 0.99),
+        "peak_mb": peak_memory_mb(),
+        "sprites": {"bombs": len(game.bombs), "beams": len(game.beams), "emys": len(game.emys), "exps": len(game.exps),
+                    "particles": len(game.particles) if game.particles is not None else 0},
+    }
+
+
+def scenario_worker(queue: multiprocessing.Queue, name: str, *args):
+    """
+    別プロセスでシナリオを実行し，結果（またはエラーの内容）をqueueに入れる
+    """
+    try:
+        queue.put(("ok", run_scenario(name, *args)))
+    except Exception:
+        queue.put(("error", traceback.format_exc()))
+
+
+def mask_worker(queue: multiprocessing.Queue, display: bool):
+    """
+    別プロセスで，画面を作ってから（display=True）または作らずに当たり判定のMaskのハッシュを求め，queueに入れる
+    """
+    try:
+        pg.init()
+        if display:
+            pg.display.set_mode((sk.WIDTH, sk.HEIGHT))
+            sk.normalize_assets()
+        queue.put(("ok", sk.mask_signature()))
+    except Exception:
+        queue.put(("error", traceback.format_exc()))
+
+
+def hyper_worker(queue: multiprocessing.Queue):
+    """
+    別プロセスで，こうかとんの向きごとに，中心から40ピクセル以内に置いた小さな爆弾が当たる回数を
+    通常とハイパーモードで数え，違っていた向きのリストをqueueに入れる
+    """
+    try:
+        pg.init()
+        bird = sk.Bird(3, (900, 400))
+        keys = {k: False for k in sk.Bird.delta}
+        probe = pg.sprite.Sprite()
+        probe.image = pg.Surface((20, 20), pg.SRCALPHA)
+        pg.draw.circle(probe.image, (255, 0, 0), (10, 10), 10)
+        probe.rect = probe.image.get_rect()
+        differ = []
+        for dire in sk.BIRD_ROTATIONS:
+            counts = []
+            for state in ("normal", "hyper"):
+                bird.change_state(state, 1)
+                bird.dire, bird.base_image = dire, sk.get_bird_img(3, dire)
+                bird.update(keys)
+                hits = 0
+                for dx in range(-40, 41, 8):
+                    for dy in range(-40, 41, 8):
+                        probe.rect.center = (bird.rect.centerx+dx, bird.rect.centery+dy)
+                        hits += sk.collide_pixel(probe, bird)
+                counts.append(hits)
+            if counts[0] != counts[1]:
+                differ.append(f"{dire}：通常 {counts[0]}回，ハイパー {counts[1]}回")
+        queue.put(("ok", differ))
+    except Exception:
+        queue.put(("error", traceback.format_exc()))
+
+
+def bundle_worker(queue: multiprocessing.Queue, path: str):
+    """
+    別プロセスで画面を作り，--build-bundleと同じようにpathへ画像バンドルを書き出す
+    """
+    try:
+        pg.init()
+        pg.display.set_mode((1, 1))
+        queue.put(("ok", sk.build_bundle(path)))
+    except Exception:
+        queue.put(("error", traceback.format_exc()))
+
+
+def explosion_worker(queue: multiprocessing.Queue, bundle: str | None):
+    """
+    別プロセスで画面を作り，画像バンドルbundleを読んでから（Noneなら読まずに）爆発の描画結果のハッシュを求め，queueに入れる
+    """
+    try:
+        pg.init()
+        pg.display.set_mode((sk.WIDTH, sk.HEIGHT))
+        sk.normalize_assets()
+        if bundle is not None and not sk.load_bundle(bundle):
+            raise RuntimeError(f"画像バンドルを読めません：{bundle}")
+        queue.put(("ok", sk.explosion_signature()))
+    except Exception:
+        queue.put(("error", traceback.format_exc()))
+
+
+def run_in_process(worker, *args):
+    """
+    workerを別プロセスで実行し，queueに入れた結果を返す（失敗したらRuntimeError）
+    """
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=worker, args=(queue, *args))
+    proc.start()
+    status, result = queue.get()
+    proc.join()
+    if status != "ok":
+        raise RuntimeError(result)
+    return result
+
+
+def run_isolated(name: str, *args) -> dict:
+    """
+    シナリオを別プロセスで実行する（最大メモリ使用量がシナリオごとに測れるようにする）
+    引数1 name：シナリオ名
+    引数2以降：run_scenarioの残りの引数
+    戻り値：run_scenarioの結果
+    """
+    try:
+        return run_in_process(scenario_worker, name, *args)
+    except RuntimeError as e:
+        raise RuntimeError(f"シナリオ {name} が失敗しました\n{e}") from None
+
+
+def check_masks() -> list[str]:
+    """
+    当たり判定のMaskが画面の有無で同じかどうか（違うと，画面で遊んだ記録を画面なしで再生できない），
+    ハイパーモードのこうかとんが通常と同じように当たるかどうかを調べる
+    戻り値：問題を説明する文字列のリスト
+    """
+    problems = []
+    display, headless = run_in_process(mask_worker, True), run_in_process(mask_worker, False)
+    if display != headless:
+        problems.append(f"当たり判定のMaskが画面の有無で違います（画面あり {display}，画面なし {headless}）")
+    for differ in run_in_process(hyper_worker):
+        problems.append(f"ハイパーモードのこうかとんの当たり判定が通常と違います（向き {differ}）")
+    return problems
+
+
+def check_bundle() -> list[str]:
+    """
+    爆発の描画結果が画像バンドルの有無で同じかどうかを調べる（バンドルは一時ファイルに作る）
+    戻り値：問題を説明する文字列のリスト
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, sk.BUNDLE_NAME)
+        run_in_process(bundle_worker, path)
+        bundled, plain = run_in_process(explosion_worker, path), run_in_process(explosion_worker, None)
+    if bundled != plain:
+        return [f"爆発の描画結果が画像バンドルの有無で違います（バンドルあり {bundled}，バンドルなし {plain}）"]
+    return []
+
+
+def check(results: dict[str, dict], baseline: dict[str, dict], threshold: float) -> list[str]:
+    """
+    基準値と比べて遅くなったシナリオを探す
+    引数1 results：今回の結果
+    引数2 baseline：基準値
+    引数3 threshold：許容する割合（0.15なら15%まで）
+    戻り値：遅くなった内容を説明する文字列のリスト
+    """
+    problems = []
+    for name, res in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if res["fps"] < base["fps"]*(1-threshold):
+            problems.append(f"{name}: fps {res['fps']:.1f} < 基準値 {base['fps']:.1f}")
+        if res["p95"] > base["p95"]*(1+threshold):
+            problems.append(f"{name}: p95 {res['p95']:.2f}ms > 基準値 {base['p95']:.2f}ms")
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="逆襲！エイリアン ベンチマーク")
+    parser.add_argument("-s", "--scenario", action="append", choices=list(SCENARIOS), help="実行するシナリオ（複数指定可）")
+    parser.add_argument("--frames", type=int, default=500, help="シナリオごとに動かすフレーム数")
+    parser.add_argument("--seed", type=int, default=0, help="乱数の種")
+    parser.add_argument("--numpy", action="store_true", help="ProjectileEngineを使う")
+    parser.add_argument("--dirty", action="store_true", help="変化した領域だけを描き直すモードで描画する")
+    parser.add_argument("--render-scale", type=float, default=1.0, help="内部解像度の画面に対する割合")
+    parser.add_argument("--scale-mode", choices=["nearest", "integer", "smooth"], default="nearest",
+                        help="内部解像度から画面への拡大のしかた")
+    parser.add_argument("--quality", type=int, choices=range(len(sk.QUALITY_LEVELS)), default=0, help="固定する画質レベル")
+    parser.add_argument("--baseline", default=BASELINE, help="基準値のファイル")
+    parser.add_argument("--save-baseline", action="store_true", help="結果を基準値として保存する")
+    parser.add_argument("--check", action="store_true",
+                        help="基準値と比べ，遅くなっていれば終了コード1を返す（当たり判定のMaskが画面の有無で違うとき，ハイパーモードの当たり判定が通常と違うとき，爆発の描画結果が画像バンドルの有無で違うときも1）")
+    parser.add_argument("--threshold", type=float, default=0.15, help="遅くなったとみなす割合")
+    parser.add_argument("--json", default=None, metavar="PATH", help="結果をJSONで書き出す")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.scenario or SCENARIOS:
+        res = run_isolated(name, args.frames, args.seed, args.numpy, args.dirty, args.render_scale, args.scale_mode,
+                           args.quality)
+        results[name] = res
+        peak = "-" if res["peak_mb"] is None else f"{res['peak_mb']:.0f}MB"
+        print(f"{name:>16}: {res['fps']:8.1f} fps  p50 {res['p50']:6.2f}  p95 {res['p95']:6.2f}  "
+              f"p99 {res['p99']:6.2f} ms  peak {peak}  {res['sprites']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"基準値を保存しました：{args.baseline}")
+    if args.check:
+        if not os.path.exists(args.baseline):
+            print(f"基準値がありません：{args.baseline}")
+            return 1
+        with open(args.baseline) as f:
+            problems = check(results, json.load(f), args.threshold)
+        for problem in problems:
+            print("遅くなりました：", problem)
+        mask_problems = check_masks()+check_bundle()
+        for problem in mask_problems:
+            print("違いがあります：", problem)
+        return 1 if problems or mask_problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+"""
+space_kokaton.pyを強化学習のエージェントから操作するための環境
+Gymと同じ形のreset/stepで，描画せずにゲームを1ステップずつ進め，観測をNumPy配列で返す
+VecKokatonEnvは複数のゲームを1回の呼び出しでまとめて進める（ゲームをワーカープロセスに分けて同時に進める）
+
+使い方（ゲームと同じく ex05 の親ディレクトリから）：
+    env = KokatonEnv(seed=0)
+    obs, info = env.reset()
+    obs, reward, terminated, truncated, info = env.step((MOVE_UP, SKILL_BEAM))
+
+    venv = VecKokatonEnv(64, seed=0)                      # CPUの数だけワーカープロセスを使う（jobs=で指定）
+    obs = venv.reset()                                    # (64, OBS_SIZE)
+    obs, rewards, dones, infos = venv.step(actions)       # actionsは(64, 2)の整数配列
+    venv.close()
+"""
+import multiprocessing
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import numpy as np
+import pygame as pg
+
+import space_kokaton as sk
+
+
+MOVES = [  # 移動の行動番号ごとの押下キー
+    (),
+    (pg.K_UP,), (pg.K_DOWN,), (pg.K_LEFT,), (pg.K_RIGHT,),
+    (pg.K_UP, pg.K_LEFT), (pg.K_UP, pg.K_RIGHT), (pg.K_DOWN, pg.K_LEFT), (pg.K_DOWN, pg.K_RIGHT),
+]
+MOVE_NONE, MOVE_UP, MOVE_DOWN, MOVE_LEFT, MOVE_RIGHT = range(5)
+SKILLS = [  # スキルの行動番号ごとの(イベント, 修飾キー)
+    ([], 0),
+    ([(pg.KEYDOWN, pg.K_SPACE)], 0),  # ビーム
+    ([(pg.KEYDOWN, pg.K_SPACE)], pg.KMOD_LSHIFT),  # 拡散ビーム
+    ([(pg.KEYDOWN, pg.K_CAPSLOCK)], 0),  # 防御壁
+    ([(pg.KEYDOWN, pg.K_TAB)], 0),  # 重力球
+    ([(pg.KEYDOWN, pg.K_RSHIFT)], 0),  # ハイパーモード
+]
+SKILL_NONE, SKILL_BEAM, SKILL_NEOBEAM, SKILL_SHIELD, SKILL_GRAVITY, SKILL_HYPER = range(6)
+
+MAX_EMYS = 8  # 観測に入れる敵機の数（こうかとんに近い順）
+MAX_BOMBS = 16  # 観測に入れる爆弾の数（こうかとんに近い順）
+MAX_BEAMS = 8  # 観測に入れるビームの数
+OBJ_SIZE = 5  # 敵機・爆弾・ビーム1つあたりの値の数（x，y，vx，vy，有効なら1）
+OBS_SLICES = {  # 観測ベクトル中の各項目の位置
+    "bird": slice(0, 4),  # x，y，向きx，向きy
+    "status": slice(4, 12),  # HP，スコア，リロードの残り秒，撃った数，ハイパーの残り，焼野原，防御壁，重力球
+    "emys": slice(12, 12+MAX_EMYS*OBJ_SIZE),
+    "bombs": slice(12+MAX_EMYS*OBJ_SIZE, 12+(MAX_EMYS+MAX_BOMBS)*OBJ_SIZE),
+    "beams": slice(12+(MAX_EMYS+MAX_BOMBS)*OBJ_SIZE, 12+(MAX_EMYS+MAX_BOMBS+MAX_BEAMS)*OBJ_SIZE),
+}
+OBS_SIZE = OBS_SLICES["beams"].stop
+GAME_OVER_REWARD = -100.0  # ゲームオーバーになったステップの報酬に加える値
+
+
+def velocity(spr: sk.Projectile) -> tuple[float, float]:
+    """
+    爆弾・ビームの1ステップの移動量を返す（エンジンに登録されていればエンジンの値）
+    """
+    if spr.engine is not None:
+        return float(spr.engine.dx[spr.slot]), float(spr.engine.dy[spr.slot])
+    return spr.speed*spr.vx, spr.speed*spr.vy
+
+
+class KokatonEnv:
+    """
+    1つのゲームをGymと同じ形（reset/step）で操作するクラス
+    行動は(移動の番号, スキルの番号)，報酬はスコアの増減（ゲームオーバーでGAME_OVER_REWARDを加える）
+    """
+    def __init__(self, seed: int | None = None, frame_skip: int = 1, max_steps: int = sk.SIM_FPS*300,
+                 numpy_engine: bool = False, caps: dict[str, int] | None = None, rules: dict[str, int] | None = None):
+        """
+        引数1 seed：最初のゲームの乱数の種（resetで種を渡さなければ1ずつ増やす）
+        引数2 frame_skip：1回のstepでゲームを進めるステップ数（同じ移動を続け，スキルは最初だけ使う）
+        引数3 max_steps：1ゲームの最大ステップ数（超えたらtruncated）
+        引数4 numpy_engine：ProjectileEngineを使うかどうか
+        引数5 caps：グループごとの上限
+        引数6 rules：ゲームバランスの設定
+        """
+        if not pg.get_init():
+            pg.init()
+        self.frame_skip = frame_skip
+        self.max_steps = max_steps
+        self.next_seed = seed
+        self.game = sk.Game(seed, numpy_engine, caps, rules, effects=False)  # 描画しないので爆発エフェクトは出さない
+        self.obs = np.zeros(OBS_SIZE, np.float32)
+
+    def reset(self, seed: int | None = None) -> tuple[np.ndarray, dict]:
+        """
+        ゲームを最初からやり直す
+        引数 seed：乱数の種（Noneのときは前回の種+1，最初の種もNoneならランダム）
+        戻り値：観測，情報の辞書
+        """
+        if seed is None and self.next_seed is not None:
+            seed = self.next_seed
+        self.game.reset(seed)
+        self.next_seed = self.game.seed+1
+        return self.observe(), self.info()
+
+    def step(self, action) -> tuple[np.ndarray, float, bool, bool, dict]:
+        """
+        行動に従ってゲームをframe_skipステップ進める
+        引数 action：(移動の番号, スキルの番号)
+        戻り値：観測，報酬，ゲームが終わったか，最大ステップ数に達したか，情報の辞書
+        """
+        game = self.game
+        move, skill = int(action[0]), int(action[1])
+        keys = {k: k in MOVES[move] for k in sk.Bird.delta}
+        events, mods = SKILLS[skill]
+        score = game.score.score
+        for i in range(self.frame_skip):
+            game.step(sk.FrameInput(keys, events if i == 0 else [], mods))
+            if game.state != "playing":
+                break
+        reward = float(game.score.score-score)
+        terminated = game.state != "playing"
+        if game.state == "over":
+            reward += GAME_OVER_REWARD
+        truncated = not terminated and game.tmr >= self.max_steps
+        return self.observe(), reward, terminated, truncated, self.info()
+
+    def info(self) -> dict:
+        game = self.game
+        return {"seed": game.seed, "steps": game.tmr, "score": game.score.score, "hp": game.hp.hp,
+                "state": game.state, "cause": game.cause}
+
+    def observe(self) -> np.ndarray:
+        """
+        ゲームの状態を観測ベクトルに書き込む（座標は画面の大きさで割って0～1にする）
+        戻り値：長さOBS_SIZEのfloat32配列（呼び出すたびに同じ配列を書き換える）
+        """
+        game, obs = self.game, self.obs
+        obs[:] = 0
+        bird = game.bird
+        bx, by = bird.rect.center
+        obs[0:4] = bx/sk.WIDTH, by/sk.HEIGHT, *bird.dire
+        reload = max(game.re+5-game.tmr/sk.SIM_FPS, 0) if game.re else 0
+        obs[4:12] = (game.hp.hp, game.score.score/100, reload, game.count,
+                     (game.hyper_timer.tick-game.tmr)/500 if bird.state == "hyper" else 0,
+                     len(game.fires) > 0, len(game.Shields) > 0, len(game.gravity) > 0)
+
+        def nearest(group, num):
+            return sorted(group, key=lambda s: (s.rect.centerx-bx)**2+(s.rect.centery-by)**2)[:num]
+
+        rows = [(s.rect.centerx, s.rect.centery, 0, s.vy) for s in nearest(game.emys, MAX_EMYS)]
+        self.write(OBS_SLICES["emys"], rows)
+        rows = [(s.rect.centerx, s.rect.centery, *velocity(s)) for s in nearest(game.bombs, MAX_BOMBS)]
+        self.write(OBS_SLICES["bombs"], rows)
+        rows = [(s.rect.centerx, s.rect.centery, *velocity(s)) for s in nearest(game.beams, MAX_BEAMS)]
+        self.write(OBS_SLICES["beams"], rows)
+        return obs
+
+    def write(self, part: slice, rows: list[tuple[float, float, float, float]]):
+        """
+        敵機・爆弾・ビームの(x, y, vx, vy)を観測ベクトルの該当部分に書き込む（足りない分は0のまま）
+        """
+        if not rows:
+            return
+        block = self.obs[part].reshape(-1, OBJ_SIZE)
+        arr = np.asarray(rows, np.float32)
+        arr /= (sk.WIDTH, sk.HEIGHT, sk.WIDTH, sk.HEIGHT)
+        block[:len(rows), :4] = arr
+        block[:len(rows), 4] = 1
+
+
+class EnvGroup:
+    """
+    複数のKokatonEnvを順に進めるクラス（VecKokatonEnvが，自分のプロセスか各ワーカープロセスで1つずつ持つ）
+    終わったゲームは自動でやり直し，そのゲームの最後の観測はinfos[i]["final_obs"]に入れる
+    """
+    def __init__(self, seeds: list[int], **kwargs):
+        """
+        引数1 seeds：ゲームごとの最初の乱数の種
+        引数2以降：KokatonEnvの引数
+        """
+        self.envs = [KokatonEnv(seed, **kwargs) for seed in seeds]
+        self.obs = np.zeros((len(seeds), OBS_SIZE), np.float32)
+        self.rewards = np.zeros(len(seeds), np.float32)
+        self.dones = np.zeros(len(seeds), bool)
+
+    def reset(self) -> np.ndarray:
+        for i, env in enumerate(self.envs):
+            self.obs[i] = env.reset()[0]
+        return self.obs
+
+    def step(self, actions) -> tuple[np.ndarray, np.ndarray, np.ndarray, list[dict]]:
+        infos = []
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            obs, reward, terminated, truncated, info = env.step(action)
+            if terminated or truncated:
+                info["final_obs"] = obs.copy()
+                obs, _ = env.reset()
+            self.obs[i] = obs
+            self.rewards[i] = reward
+            self.dones[i] = terminated or truncated
+            infos.append(info)
+        return self.obs, self.rewards, self.dones, infos
+
+
+def env_worker(conn, seeds: list[int], kwargs: dict):
+    """
+    ワーカープロセスでEnvGroupを持ち，パイプから受け取った命令（reset，step，close）を実行して結果を送り返す
+    """
+    group = EnvGroup(seeds, **kwargs)
+    while True:
+        cmd, data = conn.recv()
+        if cmd == "reset":
+            conn.send(group.reset())
+        elif cmd == "step":
+            conn.send(group.step(data))
+        else:
+            break
+    conn.close()
+
+
+class VecKokatonEnv:
+    """
+    複数のKokatonEnvを1回の呼び出しでまとめて進めるクラス
+    ゲームをjobs個のグループに分け，グループごとのワーカープロセスで同時に進めて，観測を1つの配列に積み重ねる
+    （jobsが1のときは自分のプロセスで順に進める）
+    終わったゲームは自動でやり直し，そのゲームの最後の観測はinfos[i]["final_obs"]に入れる
+    """
+    def __init__(self, num: int, seed: int = 0, jobs: int | None = None, **kwargs):
+        """
+        引数1 num：ゲームの数
+        引数2 seed：最初のゲームの乱数の種（i番目のゲームはseed+i*100000から始める）
+        引数3 jobs：ワーカープロセスの数（Noneのときはゲームの数とCPUの数の小さい方）
+        引数4以降：KokatonEnvの引数
+        """
+        jobs = min(jobs or os.cpu_count() or 1, num)
+        seeds = [seed+i*100000 for i in range(num)]
+        bounds = [num*j//jobs for j in range(jobs+1)]  # j番目のグループはbounds[j]～bounds[j+1]-1番目のゲーム
+        self.slices = [slice(bounds[j], bounds[j+1]) for j in range(jobs)]
+        self.local = None  # jobsが1のときのEnvGroup
+        self.conns, self.procs = [], []
+        if jobs == 1:
+            self.local = EnvGroup(seeds, **kwargs)
+        else:
+            ctx = multiprocessing.get_context("spawn")
+            for s in self.slices:
+                conn, child = ctx.Pipe()
+                proc = ctx.Process(target=env_worker, args=(child, seeds[s], kwargs), daemon=True)
+                proc.start()
+                child.close()
+                self.conns.append(conn)
+                self.procs.append(proc)
+        self.obs = np.zeros((num, OBS_SIZE), np.float32)
+        self.rewards = np.zeros(num, np.float32)
+        self.dones = np.zeros(num, bool)
+
+    def reset(self) -> np.ndarray:
+        """
+        すべてのゲームをやり直す
+        戻り値：(ゲームの数, OBS_SIZE)の観測
+        """
+        if self.local is not None:
+            self.obs[:] = self.local.reset()
+            return self.obs
+        for conn in self.conns:
+            conn.send(("reset", None))
+        for s, conn in zip(self.slices, self.conns):
+            self.obs[s] = conn.recv()
+        return self.obs
+
+    def step(self, actions) -> tuple[np.ndarray, np.ndarray, np.ndarray, list[dict]]:
+        """
+        すべてのゲームを1回ずつ進める（ワーカーには先に全部送ってから結果を待つので，グループは同時に進む）
+        引数 actions：(ゲームの数, 2)の行動の配列
+        戻り値：観測，報酬，終わったかどうか（truncatedを含む），情報の辞書のリスト
+        """
+        if self.local is not None:
+            obs, rewards, dones, infos = self.local.step(actions)
+            self.obs[:], self.rewards[:], self.dones[:] = obs, rewards, dones
+            return self.obs, self.rewards, self.dones, infos
+        actions = np.asarray(actions)
+        for s, conn in zip(self.slices, self.conns):
+            conn.send(("step", actions[s]))
+        infos = []
+        for s, conn in zip(self.slices, self.conns):
+            self.obs[s], self.rewards[s], self.dones[s], group_infos = conn.recv()
+            infos.extend(group_infos)
+        return self.obs, self.rewards, self.dones, infos
+
+    def close(self):
+        """
+        ワーカープロセスを終わらせる
+        """
+        for conn in self.conns:
+            conn.send(("close", None))
+            conn.close()
+        for proc in self.procs:
+            proc.join()
+        self.conns, self.procs = [], []
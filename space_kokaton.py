@@ -1,15 +1,83 @@
+import argparse
+import copy
+import csv
+import hashlib
+import heapq
+import json
 import math
+import mmap
+import os
 import random
+import struct
 import sys
+import threading
 import time
+import weakref
+from collections import deque
 import pygame
 
 import pygame as pg
 from pygame.locals import *
 
+try:
+    import numpy as np
+except ImportError:  # NumPyがなければProjectileEngineは使えない
+    np = None
+
 
 WIDTH = 1600  # ゲームウィンドウの幅
 HEIGHT = 900  # ゲームウィンドウの高さ
+FIG_DIR = "ex05/fig"  # 画像ファイルのディレクトリ
+BEAM_ANGLE_STEP = 5  # ビーム画像を事前回転しておく角度の刻み（度）
+BUNDLE_NAME = "assets.bundle"  # 読み込み・拡大・回転済みの画像をまとめたファイル（fig内に作る）
+BUNDLE_MAGIC = b"KKTB"  # 画像バンドルファイルの先頭の目印
+BUNDLE_VERSION = 2  # 画像バンドルファイルの形式の版
+BUNDLE_BAKE_VERSION = 1  # 画像の作り方（回転・透明度の扱いなど）の版（コードで作り方を変えたら上げ，古いバンドルを使わない）
+BUNDLE_HEADER = struct.Struct("<4sBI")  # 目印，版，目次JSONの長さ
+BUNDLE_ALIGN = 64  # ピクセルデータの先頭をそろえるバイト数
+
+IMG_CACHE = {}  # (ファイル名, 拡大率, 反転)をキーとした画像Surfaceのキャッシュ
+BIRD_CACHE = {}  # (こうかとん画像番号, 移動方向タプル)をキーとした画像のキャッシュ
+BEAM_CACHE = {}  # 量子化した角度をキーとしたビーム画像Surfaceのキャッシュ
+HYPER_CACHE = {}  # 元画像Surfaceをキーとしたハイパーモード画像Surfaceのキャッシュ
+FONT_CACHE = {}  # 文字サイズをキーとしたFontのキャッシュ
+ATLAS_CACHE = {}  # (文字サイズ, 色)をキーとしたDigitAtlasのキャッシュ
+BOMB_CACHE = {}  # (半径, 色)をキーとした爆弾円Surfaceのキャッシュ
+MASK_CACHE = weakref.WeakKeyDictionary()  # 画像Surfaceをキーとした衝突判定用のMask（画像が消えれば消える）
+POOLS = {}  # クラスをキーとした，削除済みで再利用を待つスプライトのリスト
+POOL_LIMIT = 512  # 1クラスあたりプールに取っておくスプライトの最大数
+SIM_FPS = 50  # 1秒あたりのシミュレーションのステップ数（ゲームの時間はすべてこの単位で数える）
+SIM_DT = 1/SIM_FPS  # 1ステップの時間（秒）
+MAX_SIM_STEPS = 5  # 描画1回の間に追いつくために進める最大ステップ数（これを超えた遅れは切り捨てる）
+BUSY_WAIT_MARGIN = 0.002  # --busy-waitのとき，スリープせずに空回りして待つ時間（秒）
+GAME_OVER_FRAMES = 100  # ゲームオーバー画面を表示するステップ数（2秒）
+DEFAULT_CAPS = {  # グループごとの同時に存在できるスプライトの最大数
+    "emys": 30,
+    "bombs": 300,
+    "beams": 200,
+    "exps": 100,
+}
+MAX_PARTICLES = 8192  # 同時に存在できるパーティクルの最大数
+PARTICLE_COLORS = [(255, 240, 120), (255, 160, 40), (230, 60, 20)]  # 破片パーティクルの色
+PARTICLE_SIZES = [2, 3, 4]  # 破片パーティクルの半径
+PARTICLE_FADE = 4  # 破片パーティクルが消えるまでの透明度の段階数
+PARTICLE_IMGS = []  # パーティクル画像の表（0，1：爆発画像，2以降：色・大きさ・透明度ごとの破片）
+QUALITY_LEVELS = [  # 画質レベルごとに軽くする内容（0が最高画質，レベルを上げると前のレベルの分も含めて軽くする）
+    "最高画質",
+    "爆発エフェクトの同時に出せる数を減らす",
+    "重力球を半透明にせず不透明で描く",
+    "爆発の破片を出さず，同時に出せる爆発をさらに減らす",
+]
+QUALITY_PARTICLES = 1024  # 画質レベル1以上で同時に出せるパーティクルの数（レベル3ではこの1/4）
+QUALITY_EXPS = 20  # 画質レベル1以上で同時に出せるExplosionの数（NumPyがないとき．レベル3ではこの1/4）
+DEFAULT_RULES = {  # ゲームバランスを決めるしきい値
+    "fire_score": 50,  # 焼野原がつくスコア
+    "hyper_score": 100,  # ハイパーモードに必要な（消費する）スコア
+    "clear_score": 300,  # ゲームクリアになるスコア
+    "hp_max": 4,  # HPの最大値
+    "interval_min": 50,  # 敵機の爆弾投下インターバルの最小値（ステップ）
+    "interval_max": 300,  # 敵機の爆弾投下インターバルの最大値（ステップ）
+}
 
 
 def check_bound(obj: pg.Rect) -> tuple[bool, bool]:
@@ -38,6 +106,459 @@ def calc_orientation(org: pg.Rect, dst: pg.Rect) -> tuple[float, float]:
     return x_diff/norm, y_diff/norm
 
 
+def to_display(img: pg.Surface) -> pg.Surface:
+    """
+    画面が作られていれば，Surfaceを画面と同じピクセル形式に変換する
+    （変換しておかないとblitのたびに形式の変換がかかる）
+    引数 img：変換するSurface
+    戻り値：変換後のSurface（画面がまだなければそのまま）
+    """
+    if pg.display.get_surface() is None:
+        return img
+    if img.get_flags() & pg.SRCALPHA:
+        return img.convert_alpha()
+    return img.convert()  # カラーキーはそのまま引き継がれる
+
+
+def with_alpha(img: pg.Surface) -> pg.Surface:
+    """
+    カラーキーで透過する画像を，ピクセルごとの透明度を持つ画像にして返す
+    （画面の形式に変換したカラーキーの画像をrotozoomすると，透明度もカラーキーもない画像になってしまうので，
+    回転・拡大する前にこれを通す）
+    引数 img：画像Surface
+    戻り値：透明度を持つ画像Surface（カラーキーがなければimgそのまま）
+    """
+    if img.get_colorkey() is None or img.get_flags() & pg.SRCALPHA:
+        return img
+    # 透明な部分を(0, 0, 0, 0)にしておく（rotozoomで縁を滑らかにするとき，カラーキーの色が混ざらない）
+    # 画面があってもなくても同じ形式で作るので，回転した画像とそのMaskはどちらでも同じになる
+    alpha = pg.Surface(img.get_size(), pg.SRCALPHA)
+    alpha.blit(img, (0, 0))
+    return alpha
+
+
+def normalize_assets():
+    """
+    画面を作る前に読み込んだ画像をすべて画面のピクセル形式に変換する
+    回転・ラプラシアンをかけた画像は元の画像から作り直すので，キャッシュを空にする
+    """
+    for cache in (IMG_CACHE, BOMB_CACHE):
+        for key, img in cache.items():
+            cache[key] = to_display(img)
+    for cache in (BIRD_CACHE, BEAM_CACHE, HYPER_CACHE, PARTICLE_IMGS):
+        cache.clear()
+
+
+def fig_path(name: str) -> str:
+    """
+    画像ファイルのパスを返す
+    実行したディレクトリからFIG_DIRが見つからないときは，このファイルと同じ場所のfigを使う
+    引数 name：fig内の画像ファイル名
+    戻り値：画像ファイルのパス
+    """
+    path = os.path.join(FIG_DIR, name)
+    if not os.path.exists(path):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fig", name)
+    return path
+
+
+def load_img(name: str, scale: float = 1.0, flip: tuple[bool, bool] = (False, False)) -> pg.Surface:
+    """
+    画像ファイルを一度だけ読み込み，拡大・反転したSurfaceをキャッシュして返す
+    引数1 name：fig内の画像ファイル名
+    引数2 scale：拡大率
+    引数3 flip：横方向，縦方向に反転するかどうかのタプル
+    戻り値：画像Surface（2回目以降はキャッシュ済みのもの）
+    """
+    key = (name, scale, flip)
+    if key not in IMG_CACHE:
+        img = pg.image.load(fig_path(name))
+        if scale != 1.0:
+            img = pg.transform.rotozoom(img, 0, scale)
+        if flip != (False, False):
+            img = pg.transform.flip(img, *flip)
+        IMG_CACHE[key] = to_display(img)
+    return IMG_CACHE[key]
+
+
+BIRD_ROTATIONS = {  # 移動方向タプルをキーとした(左右反転した画像を使うかどうか, 回転角度)
+    (+1, 0): (True, 0),  # 右（デフォルトのこうかとん）
+    (+1, -1): (True, 45),  # 右上
+    (0, -1): (True, 90),  # 上
+    (-1, -1): (False, -45),  # 左上
+    (-1, 0): (False, 0),  # 左
+    (-1, +1): (False, 45),  # 左下
+    (0, +1): (True, -90),  # 下
+    (+1, +1): (True, -45),  # 右下
+}
+
+
+def get_bird_img(num: int, dire: tuple[int, int]) -> pg.Surface:
+    """
+    こうかとんの向き別画像を，初めて使うときに一度だけ生成してキャッシュする
+    引数1 num：こうかとん画像ファイル名の番号
+    引数2 dire：移動方向タプル
+    戻り値：向きに合わせて回転した画像Surface
+    """
+    key = (num, dire)
+    if key not in BIRD_CACHE:
+        flip, angle = BIRD_ROTATIONS[dire]
+        img = load_img(f"{num}.png", 2.0, (flip, False))
+        BIRD_CACHE[key] = img if angle == 0 else to_display(pg.transform.rotozoom(with_alpha(img), angle, 1.0))
+    return BIRD_CACHE[key]
+
+
+def get_enemy_imgs() -> list[pg.Surface]:
+    """
+    敵機の画像のリストを返す（初めて使うときに読み込む）
+    """
+    return [load_img(f"alien{i}.png") for i in range(1, 4)]
+
+
+def get_hyper_img(img: pg.Surface) -> pg.Surface:
+    """
+    ハイパーモード用にラプラシアンをかけた画像をキャッシュして返す
+    引数 img：元の画像Surface（キャッシュ済みのもの）
+    戻り値：ラプラシアンをかけた画像Surface
+    """
+    if img not in HYPER_CACHE:
+        HYPER_CACHE[img] = to_display(pg.transform.laplacian(img))
+    return HYPER_CACHE[img]
+
+
+def get_beam_img(angle: float) -> pg.Surface:
+    """
+    BEAM_ANGLE_STEP刻みに量子化した角度で回転済みのビーム画像を返す
+    引数 angle：ビームの角度（度）
+    戻り値：回転・拡大済みのビーム画像Surface
+    """
+    key = round(angle/BEAM_ANGLE_STEP)*BEAM_ANGLE_STEP % 360
+    if key not in BEAM_CACHE:
+        BEAM_CACHE[key] = to_display(pg.transform.rotozoom(with_alpha(load_img("beam.png")), key, 2.0))
+    return BEAM_CACHE[key]
+
+
+def get_bomb_img(rad: int, color: tuple[int, int, int]) -> pg.Surface:
+    """
+    半径と色ごとに爆弾円Surfaceを一度だけ生成して返す
+    引数1 rad：爆弾円の半径
+    引数2 color：爆弾円の色
+    戻り値：爆弾円Surface
+    """
+    key = (rad, color)
+    if key not in BOMB_CACHE:
+        img = pg.Surface((2*rad, 2*rad))
+        pg.draw.circle(img, color, (rad, rad), rad)
+        img.set_colorkey((0, 0, 0))
+        BOMB_CACHE[key] = to_display(img)
+    return BOMB_CACHE[key]
+
+
+def get_mask(img: pg.Surface) -> pg.Mask:
+    """
+    画像の不透明な部分のMaskを一度だけ作って返す
+    爆弾の半径，ビームの角度，こうかとんの向き，敵機の画像などはキャッシュ済みの画像を使い回すので，Maskも画像ごとに1つで済む
+    引数 img：画像Surface（カラーキーがあればその色，なければアルファが127以下の部分を透明とする）
+    戻り値：Mask
+    """
+    mask = MASK_CACHE.get(img)
+    if mask is None:
+        mask = MASK_CACHE[img] = pg.mask.from_surface(img)
+    return mask
+
+
+def hit_image(spr: pg.sprite.Sprite) -> pg.Surface:
+    """
+    当たり判定に使う画像を返す
+    見た目の効果をかける前の画像（こうかとんのbase_image）があればそれを使う
+    （ハイパーモードの輪郭だけの画像で判定すると，ほとんど当たらなくなる）
+    """
+    return getattr(spr, "base_image", spr.image)
+
+
+def collide_pixel(a: pg.sprite.Sprite, b: pg.sprite.Sprite) -> bool:
+    """
+    rectが重なっている2つのスプライトが，不透明なピクセル同士で重なっているかどうかを返す
+    （円い爆弾や重力球，回転したビームの透明な角では当たらない）
+    """
+    return get_mask(hit_image(a)).overlap(get_mask(hit_image(b)), (b.rect.x-a.rect.x, b.rect.y-a.rect.y)) is not None
+
+
+def mask_signature() -> str:
+    """
+    当たり判定に使うすべての画像（ビームの角度，こうかとんの向き（ハイパーモードを含む），爆弾，敵機，重力球，防御壁）の
+    Maskのビット数からハッシュを作って返す
+    画面があってもなくても同じ値になる（違えば，画面の有無でゲームの進み方が変わってしまう）
+    戻り値：16進数の文字列
+    """
+    prebake_imgs()
+    bird = Bird(3, (900, 400))
+    imgs = [get_beam_img(angle) for angle in range(0, 360, BEAM_ANGLE_STEP)]
+    imgs += [load_img("3.png", 2.0), *(get_bird_img(3, dire) for dire in BIRD_ROTATIONS)]
+    bird.change_state("hyper", 1)
+    for dire in BIRD_ROTATIONS:  # ハイパーモードでも見た目の効果をかける前の画像で判定する
+        bird.dire, bird.base_image = dire, get_bird_img(3, dire)
+        bird.update({k: False for k in Bird.delta})
+        imgs.append(hit_image(bird))
+    imgs += [get_bomb_img(rad, color) for rad in range(10, 51) for color in Bomb.colors]
+    imgs += [*get_enemy_imgs(), Gravity(bird, 200, 1).image, Shield(bird, 1).image]
+    counts = ",".join(str(get_mask(img).count()) for img in imgs)
+    return hashlib.sha1(counts.encode()).hexdigest()[:16]
+
+
+def explosion_signature() -> str:
+    """
+    爆発の画像（Explosionの2枚とパーティクルの爆発画像2枚）を背景に描いた結果のピクセルからハッシュを作って返す
+    画像バンドルを使っても使わなくても同じ値になる（違えば，バンドルの有無で爆発の見た目が変わってしまう）
+    画面を作ってから呼ぶこと
+    戻り値：16進数の文字列
+    """
+    imgs = [load_img("explosion.gif"), load_img("explosion.gif", flip=(True, True)), *get_particle_imgs()[:2]]
+    canvas = pg.Surface((sum(img.get_width() for img in imgs), max(img.get_height() for img in imgs))).convert()
+    canvas.fill((10, 20, 30))
+    x = 0
+    for img in imgs:
+        canvas.blit(img, (x, 0))
+        x += img.get_width()
+    return hashlib.sha1(pg.image.tobytes(canvas, "RGB")).hexdigest()[:16]
+
+
+def get_particle_imgs() -> list[pg.Surface]:
+    """
+    パーティクル画像の表を一度だけ作って返す
+    0，1番は爆発画像（Explosionと同じ2枚），2番以降は(色, 大きさ, 透明度)ごとの破片の円
+    戻り値：画像Surfaceのリスト
+    """
+    if not PARTICLE_IMGS:
+        for img in (load_img("explosion.gif"), load_img("explosion.gif", flip=(True, True))):
+            key = img.get_colorkey()
+            if key is None:  # 画像バンドルから読んだ画像はカラーキーでなくアルファで透過するので，そのまま使う
+                img = to_display(img)
+            elif pg.display.get_surface() is not None:  # 爆発画像は不透明なので，アルファなし＋カラーキーにした方が速く描ける
+                img = img.convert()
+                img.set_colorkey(key, pg.RLEACCEL)
+            PARTICLE_IMGS.append(img)
+        for color in PARTICLE_COLORS:
+            for rad in PARTICLE_SIZES:
+                for level in range(PARTICLE_FADE):  # 残り寿命が短いほど薄くする
+                    img = pg.Surface((2*rad, 2*rad), pg.SRCALPHA)
+                    pg.draw.circle(img, (*color, 255*(level+1)//PARTICLE_FADE), (rad, rad), rad)
+                    PARTICLE_IMGS.append(to_display(img))
+    return PARTICLE_IMGS
+
+
+def spawn(cls: type, *args) -> pg.sprite.Sprite:
+    """
+    プールに削除済みのスプライトがあれば初期化し直して再利用し，なければ新しく作る
+    引数1 cls：作るスプライトのクラス（Bomb，Beam，Explosion）
+    引数2以降：clsの初期化の引数
+    戻り値：スプライト
+    """
+    pool = POOLS.get(cls)
+    if pool:
+        spr = pool.pop()
+        spr.__init__(*args)
+        return spr
+    return cls(*args)
+
+
+def recycle(spr: pg.sprite.Sprite):
+    """
+    削除したスプライトをプールに戻す
+    引数 spr：削除したスプライト
+    """
+    pool = POOLS.setdefault(type(spr), [])
+    if len(pool) < POOL_LIMIT:
+        pool.append(spr)
+
+
+def prebake_imgs(bird_num: int = 3, change_nums: tuple[int, ...] = (6, 8, 10)):
+    """
+    ゲーム中に使う画像をあらかじめ読み込み・回転しておく
+    （スプライト生成時にディスクアクセスや回転処理が走らないようにする）
+    ゲームが実際に使う画像だけを作る．Bird.change_imgの画像は回転しないので，向き別の画像は作らない
+    引数1 bird_num：こうかとんの画像の番号（8方向とハイパーモードの画像を作る）
+    引数2 change_nums：Bird.change_imgで切り替える画像の番号（喜びの6はその場でハイパーモードになりうるので，その画像も作る）
+    """
+    for angle in range(0, 360, BEAM_ANGLE_STEP):
+        get_beam_img(angle)
+    for dire in BIRD_ROTATIONS:
+        get_hyper_img(get_bird_img(bird_num, dire))
+    for num in change_nums:
+        load_img(f"{num}.png", 2.0)
+    get_hyper_img(load_img("6.png", 2.0))
+    get_enemy_imgs()
+    load_img("pg_bg.jpg")
+    load_img("text_gameclear.png")
+    load_img("explosion.gif")
+    load_img("explosion.gif", flip=(True, True))
+    for rad in range(10, 51):
+        for color in Bomb.colors:
+            get_bomb_img(rad, color)
+    get_particle_imgs()
+
+
+def bake_signature() -> str:
+    """
+    画像の作り方を決める値（BUNDLE_BAKE_VERSION，ビームの角度の刻み，こうかとんの回転，prebake_imgsの引数）のハッシュを返す
+    画像バンドルに記録し，コードの方の値が変わっていれば古いバンドルは使わない
+    """
+    params = {"version": BUNDLE_BAKE_VERSION, "beam_step": BEAM_ANGLE_STEP,
+              "bird_rotations": [[*dire, *rot] for dire, rot in BIRD_ROTATIONS.items()],
+              "prebake": prebake_imgs.__defaults__}
+    return hashlib.sha1(json.dumps(params).encode()).hexdigest()[:16]
+
+
+def build_bundle(path: str) -> int:
+    """
+    prebake_imgsで作る画像（爆弾円以外）をピクセルのまま1つのファイルにまとめる
+    透過する画像はBGRA（画面のconvert_alphaと同じ並び），それ以外はRGBで書き出す
+    ゲーム中と同じ画像になるよう，画面を作ってから（画面の形式に変換した画像から回転して）呼ぶこと
+    引数 path：書き出すファイル名
+    戻り値：書き出したバイト数
+    """
+    prebake_imgs()
+    blocks, entries, data = [], [], []
+    offset = 0
+    block_of = {}  # キャッシュにある画像Surfaceをキーとしたblocksの番号（同じ画像は1回だけ書き出す）
+    key_of = {}  # キャッシュにある画像Surfaceをキーとした，最初に登録したときのキャッシュのキー
+
+    def add(key: list, img: pg.Surface):
+        nonlocal offset
+        if img not in block_of:
+            out = img
+            if img.get_flags() & pg.SRCALPHA or img.get_colorkey() is not None:
+                if not img.get_flags() & pg.SRCALPHA:  # カラーキーは透明度0のピクセルにする
+                    out = pg.Surface(img.get_size(), pg.SRCALPHA)
+                    out.blit(img, (0, 0))
+                fmt = "BGRA"
+            else:
+                fmt = "RGB"
+            pixels = pg.image.tobytes(out, fmt)
+            block_of[img] = len(blocks)
+            key_of[img] = key
+            blocks.append([offset, *img.get_size(), fmt])
+            data.append(pixels+bytes(-len(pixels) % BUNDLE_ALIGN))
+            offset += len(data[-1])
+        entries.append([key, block_of[img]])
+
+    for (name, scale, flip), img in IMG_CACHE.items():
+        add(["img", name, scale, list(flip)], img)
+    for (num, dire), img in BIRD_CACHE.items():
+        add(["bird", num, list(dire)], img)
+    for angle, img in BEAM_CACHE.items():
+        add(["beam", angle], img)
+    for base, img in HYPER_CACHE.items():  # 元の画像は，そのキャッシュのキーで指す
+        add(["hyper", key_of[base]], img)
+    sources = {}  # 元の画像ファイルが変わっていたらバンドルを使わない
+    for name, _, _ in IMG_CACHE:
+        st = os.stat(fig_path(name))
+        sources[name] = [st.st_size, st.st_mtime_ns]
+    index = json.dumps({"sources": sources, "bake": bake_signature(), "blocks": blocks, "entries": entries}).encode()
+    head = BUNDLE_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(index))+index
+    head += bytes(-len(head) % BUNDLE_ALIGN)
+    with open(path, "wb") as f:
+        f.write(head)
+        for pixels in data:
+            f.write(pixels)
+    return len(head)+offset
+
+
+def load_bundle(path: str) -> bool:
+    """
+    build_bundleで作ったファイルをメモリマップし，画像のキャッシュに登録する
+    透過する画像はファイルのページをそのまま参照するSurfaceにする（デコードもコピーもしない）
+    引数 path：画像バンドルファイル名
+    戻り値：使えたらTrue，ファイルが古い・形式が違うときはFalse
+    """
+    with open(path, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)  # 書き込んでも他のプロセスには影響しない
+    magic, version, index_len = BUNDLE_HEADER.unpack_from(buf, 0)
+    if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+        return False
+    index = json.loads(buf[BUNDLE_HEADER.size:BUNDLE_HEADER.size+index_len])
+    if index.get("bake") != bake_signature():  # 画像の作り方が変わっている
+        return False
+    for name, (size, mtime) in index["sources"].items():
+        st = os.stat(fig_path(name))
+        if (st.st_size, st.st_mtime_ns) != (size, mtime):
+            return False
+    start = BUNDLE_HEADER.size+index_len
+    start += -start % BUNDLE_ALIGN
+    view = memoryview(buf)
+    alpha_masks = None  # 画面のconvert_alphaの形式（これと同じならそのまま使う）
+    if pg.display.get_surface() is not None:
+        alpha_masks = pg.Surface((1, 1), pg.SRCALPHA).convert_alpha().get_masks()
+    surfs = []
+    cached = {}  # キャッシュのキー（JSONの文字列）をキーとした画像Surface
+    for offset, w, h, fmt in index["blocks"]:
+        length = w*h*len(fmt)
+        img = pg.image.frombuffer(view[start+offset:start+offset+length], (w, h), fmt)
+        if fmt != "BGRA" or (alpha_masks is not None and img.get_masks() != alpha_masks):
+            img = to_display(img)
+        surfs.append(img)
+    for key, block in index["entries"]:
+        kind, *args = key
+        cached[json.dumps(key)] = surfs[block]
+        if kind == "img":
+            IMG_CACHE[(args[0], args[1], tuple(args[2]))] = surfs[block]
+        elif kind == "bird":
+            BIRD_CACHE[(args[0], tuple(args[1]))] = surfs[block]
+        elif kind == "beam":
+            BEAM_CACHE[args[0]] = surfs[block]
+        else:  # 元の画像のエントリはハイパーモードの画像より前に書いてある
+            HYPER_CACHE[cached[json.dumps(args[0])]] = surfs[block]
+    return True
+
+
+class AssetLoader(threading.Thread):
+    """
+    prebake_imgsを別スレッドで実行するクラス（その間，メインスレッドはロード画面を表示する）
+    画像バンドルがあれば，先にそこから読み込む
+    """
+    def __init__(self, bundle: str | None = None):
+        """
+        引数 bundle：画像バンドルファイル名（Noneのときは使わない）
+        """
+        super().__init__(daemon=True)
+        self.bundle = bundle
+        self.used_bundle = False  # 画像バンドルを使えたかどうか
+        self.error = None  # 読み込み中に発生した例外
+
+    def run(self):
+        try:
+            if self.bundle is not None and os.path.exists(self.bundle):
+                self.used_bundle = load_bundle(self.bundle)
+            prebake_imgs()  # バンドルにない画像（爆弾円など）を作る
+        except Exception as e:
+            self.error = e
+
+
+def show_loading(screen: pg.Surface, loader: AssetLoader) -> bool:
+    """
+    画像の読み込みが終わるまでロード画面を表示する
+    引数1 screen：画面Surface
+    引数2 loader：読み込み中のAssetLoader
+    戻り値：読み込みが終わったらTrue，途中でウィンドウを閉じられたらFalse
+    """
+    font = get_font(50)
+    clock = pg.time.Clock()
+    tmr = 0
+    while loader.is_alive():
+        for event in pg.event.get():
+            if event.type == pg.QUIT:
+                return False
+        screen.fill((0, 0, 0))
+        text = font.render("Loading"+"."*(tmr//10%4), True, (255, 255, 255))
+        screen.blit(text, text.get_rect(center=(WIDTH//2, HEIGHT//2)))
+        pg.display.update()
+        tmr += 1
+        clock.tick(50)
+    if loader.error is not None:
+        raise loader.error
+    return True
+
+
 class Bird(pg.sprite.Sprite):
     """
     ゲームキャラクター（こうかとん）に関するクラス
@@ -56,33 +577,22 @@ class Bird(pg.sprite.Sprite):
         引数2 xy：こうかとん画像の位置座標タプル
         """
         super().__init__()
-        img0 = pg.transform.rotozoom(pg.image.load(f"ex05/fig/{num}.png"), 0, 2.0)
-        img = pg.transform.flip(img0, True, False)  # デフォルトのこうかとん
-        self.imgs = {
-            (+1, 0): img,  # 右
-            (+1, -1): pg.transform.rotozoom(img, 45, 1.0),  # 右上
-            (0, -1): pg.transform.rotozoom(img, 90, 1.0),  # 上
-            (-1, -1): pg.transform.rotozoom(img0, -45, 1.0),  # 左上
-            (-1, 0): img0,  # 左
-            (-1, +1): pg.transform.rotozoom(img0, 45, 1.0),  # 左下
-            (0, +1): pg.transform.rotozoom(img, -90, 1.0),  # 下
-            (+1, +1): pg.transform.rotozoom(img, -45, 1.0),  # 右下
-        }
+        self.num = num
         self.dire = (+1, 0)
-        self.image = self.imgs[self.dire]
+        self.base_image = get_bird_img(num, self.dire)  # ハイパーモードの効果をかける前の画像
+        self.image = self.base_image
         self.rect = self.image.get_rect()
         self.rect.center = xy
         self.speed = 10
         self.state = "normal"
 
-    def change_img(self, num: int, screen: pg.Surface):
+    def change_img(self, num: int):
         """
-        こうかとん画像を切り替え，画面に転送する
-        引数1 num：こうかとん画像ファイル名の番号
-        引数2 screen：画面Surface
+        こうかとん画像を切り替える（画面への転送はRendererが行う）
+        引数 num：こうかとん画像ファイル名の番号
         """
-        self.image = pg.transform.rotozoom(pg.image.load(f"ex05/fig/{num}.png"), 0, 2.0)
-        screen.blit(self.image, self.rect)
+        self.base_image = load_img(f"{num}.png", 2.0)
+        self.image = self.base_image
 
     def change_state(self, state: str, hyper_life: int):
         self.state = state
@@ -90,11 +600,10 @@ class Bird(pg.sprite.Sprite):
 
         
 
-    def update(self, key_lst: list[bool], screen: pg.Surface):
+    def update(self, key_lst: dict[int, bool]):
         """
         押下キーに応じてこうかとんを移動させる
-        引数1 key_lst：押下キーの真理値リスト
-        引数2 screen：画面Surface
+        引数 key_lst：押下キーの真理値辞書（FrameInput.keys）
         """
         sum_mv = [0, 0]
         for k, mv in __class__.delta.items():
@@ -108,14 +617,11 @@ class Bird(pg.sprite.Sprite):
                     self.rect.move_ip(-self.speed*mv[0], -self.speed*mv[1])
         if not (sum_mv[0] == 0 and sum_mv[1] == 0):
             self.dire = tuple(sum_mv)
-            self.image = self.imgs[self.dire]
+            self.base_image = get_bird_img(self.num, self.dire)
+        self.image = self.base_image
 
-        if self.state == "hyper":
-            self.image = pg.transform.laplacian(self.image)
-            self.hyper_life -= 1
-            if self.hyper_life < 0:
-                self.change_state("normal",-1)
-        screen.blit(self.image, self.rect)
+        if self.state == "hyper":  # ハイパーモードの終わりはGameがSchedulerで決める
+            self.image = get_hyper_img(self.base_image)
 
     def get_direction(self) -> tuple[int, int]:
         return self.dire
@@ -123,24 +629,45 @@ class Bird(pg.sprite.Sprite):
 
     
 
-class Bomb(pg.sprite.Sprite):
+class Projectile(pg.sprite.Sprite):
+    """
+    爆弾とビームに共通するクラス
+    ProjectileEngineに登録されているときは，移動や反射をエンジンがまとめて行う
+    """
+    def __init__(self):
+        super().__init__()
+        self.engine = None  # 登録先のProjectileEngine
+        self.slot = None  # エンジンの配列中の位置
+
+    def kill(self):
+        """
+        すべてのグループから削除し，エンジンに登録されていれば配列の位置を空けて，プールに戻す
+        """
+        if not self.alive():
+            return
+        super().kill()
+        if self.engine is not None:
+            self.engine.release(self)
+        recycle(self)
+
+
+class Bomb(Projectile):
     """
     爆弾に関するクラス
     """
     colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255), (0, 255, 255)]
 
-    def __init__(self, emy: "Enemy", bird: Bird):
+    def __init__(self, emy: "Enemy", bird: Bird, rng: random.Random = random):
         """
         爆弾円Surfaceを生成する
         引数1 emy：爆弾を投下する敵機
         引数2 bird：攻撃対象のこうかとん
+        引数3 rng：乱数生成器（Game.rng）
         """
         super().__init__()
-        rad = random.randint(10, 50)  # 爆弾円の半径：10以上50以下の乱数
-        color = random.choice(__class__.colors)  # 爆弾円の色：クラス変数からランダム選択
-        self.image = pg.Surface((2*rad, 2*rad))
-        pg.draw.circle(self.image, color, (rad, rad), rad)
-        self.image.set_colorkey((0, 0, 0))
+        rad = rng.randint(10, 50)  # 爆弾円の半径：10以上50以下の乱数
+        color = rng.choice(__class__.colors)  # 爆弾円の色：クラス変数からランダム選択
+        self.image = get_bomb_img(rad, color)  # 半径と色が同じ爆弾は同じSurfaceを使う
         self.rect = self.image.get_rect()
         # 爆弾を投下するemyから見た攻撃対象のbirdの方向を計算
         self.vx, self.vy = calc_orientation(emy.rect, bird.rect)  
@@ -166,7 +693,7 @@ class Bomb(pg.sprite.Sprite):
 
 
 
-class Beam(pg.sprite.Sprite):
+class Beam(Projectile):
     """
     ビームに関するクラス
     """
@@ -179,7 +706,7 @@ class Beam(pg.sprite.Sprite):
         self.vx, self.vy = bird.get_direction()
         angle = math.degrees(math.atan2(-self.vy, self.vx))
         angle += spin #angleにspinを加える
-        self.image = pg.transform.rotozoom(pg.image.load(f"ex05/fig/beam.png"), angle, 2.0)
+        self.image = get_beam_img(angle)
         self.vx = math.cos(math.radians(angle))
         self.vy = -math.sin(math.radians(angle))
         self.rect = self.image.get_rect()
@@ -206,7 +733,7 @@ class Hp: #HPバー
         self.hp = max # HP
         self.mark = int((self.width - 4) / self.max) # HPバーの1目盛り
 
-        self.font = pg.font.SysFont(None, 28)
+        self.font = get_font(28)
         self.label = self.font.render("HP", True, (255, 255, 255))
         self.frame = Rect(self.x + 2 + self.label.get_width(), self.y, self.width, self.label.get_height())
         self.bar = Rect(self.x + 4 + self.label.get_width(), self.y + 2, self.width - 4, self.label.get_height() - 4)
@@ -214,6 +741,8 @@ class Hp: #HPバー
 
         self.effect_bar = Rect(self.x + 4 + self.label.get_width(), self.y + 2, self.width - 4, self.label.get_height() - 4)
         self.effect_color = (0, 255, 255)
+        self.image = None  # HPバー全体を描画したSurface
+        self.drawn = None  # self.imageを描画したときの(値の幅, エフェクトの幅, エフェクトの色)
     
     def update(self):
         if self.hp >= self.max:
@@ -233,12 +762,30 @@ class Hp: #HPバー
         else:
             self.effect_color = (255, 0, 0)
 
+    def values(self) -> tuple:
+        """
+        HPバーの表示を決める値（HP，最大HP，値の幅，エフェクトの幅，エフェクトの色）を返す
+        """
+        return self.hp, self.max, self.value.width, self.effect_bar.width, self.effect_color
+
+    def show(self, values: tuple):
+        """
+        valuesで返した値を写す（--pipelineで，描画のスレッドのHpにSnapshotの値を写して描く）
+        """
+        self.hp, self.max, self.value.width, self.effect_bar.width, self.effect_color = values
+
     def draw(self, screen):
-        pg.draw.rect(screen, (255, 255, 255), self.frame)
-        pg.draw.rect(screen, (0, 0, 0), self.bar)
-        pg.draw.rect(screen, self.effect_color, self.effect_bar)
-        pg.draw.rect(screen, (0, 255, 0), self.value)
-        screen.blit(self.label, (self.x, self.y))
+        state = (self.value.width, self.effect_bar.width, self.effect_color)
+        if state != self.drawn:  # HPが変わったときだけバーを描き直す
+            self.drawn = state
+            self.image = pg.Surface((self.frame.right-self.x, max(self.frame.bottom, self.y+self.label.get_height())-self.y), pg.SRCALPHA)
+            offset = (-self.x, -self.y)
+            pg.draw.rect(self.image, (255, 255, 255), self.frame.move(offset))
+            pg.draw.rect(self.image, (0, 0, 0), self.bar.move(offset))
+            pg.draw.rect(self.image, self.effect_color, self.effect_bar.move(offset))
+            pg.draw.rect(self.image, (0, 255, 0), self.value.move(offset))
+            self.image.blit(self.label, (0, 0))
+        screen.blit(self.image, (self.x, self.y))
 
 
 class NeoBeam: #追加機能４弾幕
@@ -249,7 +796,7 @@ class NeoBeam: #追加機能４弾幕
     def gen_beams(self): #こうかとんに対し-50°~50°の範囲にbeamを発生させる
         beam_ls = []
         for spin in range(-50, 51, 25):
-            beam = Beam(self.bird, spin)
+            beam = spawn(Beam, self.bird, spin)
             beam_ls.append(beam)
         return beam_ls
 
@@ -264,21 +811,36 @@ class Explosion(pg.sprite.Sprite):
         引数2 life：爆発時間
         """
         super().__init__()
-        img = pg.image.load("ex05/fig/explosion.gif")
-        self.imgs = [img, pg.transform.flip(img, 1, 1)]
-        self.image = self.imgs[0]
-        self.rect = self.image.get_rect(center=obj.rect.center)
+        self.imgs = [load_img("explosion.gif"), load_img("explosion.gif", flip=(True, True))]
         self.life = life
+        self.frame = (life-1)//10%2  # 表示している画像の番号
+        self.image = self.imgs[self.frame]
+        self.rect = self.image.get_rect(center=obj.rect.center)
 
-    def update(self):
+    def schedule(self, timers: "Scheduler", now: int):
         """
-        爆発時間を1減算した爆発経過時間_lifeに応じて爆発画像を切り替えることで
-        爆発エフェクトを表現する
+        10ステップごとの画像の切り替えと，爆発時間が過ぎたときの削除を予定する
+        （残り爆発時間//10が変わるステップで画像を切り替えることで爆発エフェクトを表現する）
+        引数1 timers：予定を登録するScheduler
+        引数2 now：爆発が始まったステップ
         """
-        self.life -= 1
-        self.image = self.imgs[self.life//10%2]
-        if self.life < 0:
-            self.kill()
+        first = (self.life-1)%10+1  # 最初に画像を切り替えるまでのステップ数
+        if first < self.life:
+            timers.every(now+first, 10, self.flip, count=(self.life-first-1)//10+1)
+        timers.at(now+self.life, self.kill)
+
+    def flip(self):
+        self.frame ^= 1
+        self.image = self.imgs[self.frame]
+
+    def kill(self):
+        """
+        すべてのグループから削除し，プールに戻す
+        """
+        if not self.alive():
+            return
+        super().kill()
+        recycle(self)
 
 
 class Shield(pg.sprite.Sprite):
@@ -289,29 +851,28 @@ class Shield(pg.sprite.Sprite):
          self.rect = self.image.get_rect()
          self.rect.centerx = bird.rect.centerx+50
          self.rect.centery = bird.rect.centery
-         self.life = life
-         
-    def update(self):
-        self.life -= 1
-        if self.life < 0:
-            self.kill() #Shiledsグループからの削除
+         self.life = life  # 消えるまでのステップ数（GameがSchedulerで削除する）
 
 
 class Enemy(pg.sprite.Sprite):
     """
     敵機に関するクラス
     """
-    imgs = [pg.image.load(f"ex05/fig/alien{i}.png") for i in range(1, 4)]
-    
-    def __init__(self):
+    def __init__(self, rng: random.Random = random, interval: tuple[int, int] = (50, 300)):
+        """
+        引数1 rng：乱数生成器（Game.rng）
+        引数2 interval：爆弾投下インターバルの範囲
+        """
         super().__init__()
-        self.image = random.choice(__class__.imgs)
+        self.image = rng.choice(get_enemy_imgs())
         self.rect = self.image.get_rect()
-        self.rect.center = random.randint(0, WIDTH), 0
+        self.rect.center = rng.randint(0, WIDTH), 0
         self.vy = +6
-        self.bound = random.randint(50, HEIGHT/2)  # 停止位置
+        self.bound = rng.randint(50, HEIGHT//2)  # 停止位置
         self.state = "down"  # 降下状態or停止状態
-        self.interval = random.randint(50, 300)  # 爆弾投下インターバル
+        self.interval = rng.randint(*interval)  # 爆弾投下インターバル
+        self.on_stop = None  # 停止状態になったときに呼ぶ関数（Gameが爆弾投下を予定する）
+        self.drop_timer = None  # 爆弾投下のTimer
 
     def update(self):
         """
@@ -321,10 +882,110 @@ class Enemy(pg.sprite.Sprite):
         """
         if self.rect.centery > self.bound:
             self.vy = 0
-            self.state = "stop"
+            if self.state != "stop":
+                self.state = "stop"
+                if self.on_stop is not None:
+                    self.on_stop(self)
         self.rect.centery += self.vy
 
 
+def get_font(size: int) -> pg.font.Font:
+    """
+    デフォルトフォントを文字サイズごとに一度だけ生成して返す
+    引数 size：文字サイズ
+    戻り値：Font
+    """
+    if size not in FONT_CACHE:
+        FONT_CACHE[size] = pg.font.Font(None, size)
+    return FONT_CACHE[size]
+
+
+class DigitAtlas:
+    """
+    数値表示に使う文字（0～9，-，.）をあらかじめ描画しておくクラス
+    数値が変わるたびにfont.renderを呼ばず，グリフを並べて文字列Surfaceを組み立てる
+    """
+    chars = "0123456789-."
+
+    def __init__(self, size: int, color: tuple[int, int, int]):
+        """
+        引数1 size：文字サイズ
+        引数2 color：文字色
+        """
+        self.font = get_font(size)
+        self.color = color
+        self.glyphs = {c: self.font.render(c, 0, color) for c in __class__.chars}
+        self.height = self.font.get_height()
+        self.labels = {}  # ラベル文字列をキーとしたラベル部分のSurface
+
+    def label(self, text: str) -> pg.Surface:
+        """
+        ラベル文字列を一度だけ描画して返す
+        （一度描いたラベルはフォントを使わないので，--pipelineのシミュレーションのスレッドからも作れる）
+        引数 text：ラベル文字列
+        戻り値：ラベル部分のSurface
+        """
+        if text not in self.labels:
+            self.labels[text] = self.font.render(text, 0, self.color)
+        return self.labels[text]
+
+    def render(self, prefix: pg.Surface, value) -> pg.Surface:
+        """
+        ラベルSurfaceの後ろに数値のグリフを並べたSurfaceを返す
+        引数1 prefix：ラベル部分のSurface
+        引数2 value：表示する数値
+        戻り値：組み立てた文字列Surface
+        """
+        glyphs = [self.glyphs[c] for c in str(value)]
+        width = prefix.get_width() + sum(g.get_width() for g in glyphs)
+        image = pg.Surface((width, self.height), pg.SRCALPHA)
+        image.blit(prefix, (0, 0))
+        x = prefix.get_width()
+        for g in glyphs:
+            image.blit(g, (x, 0))
+            x += g.get_width()
+        return image
+
+
+def get_digit_atlas(size: int, color: tuple[int, int, int]) -> DigitAtlas:
+    """
+    文字サイズと色ごとにDigitAtlasを一度だけ生成して返す
+    引数1 size：文字サイズ
+    引数2 color：文字色
+    戻り値：DigitAtlas
+    """
+    if (size, color) not in ATLAS_CACHE:
+        ATLAS_CACHE[(size, color)] = DigitAtlas(size, color)
+    return ATLAS_CACHE[(size, color)]
+
+
+class HudText:
+    """
+    「ラベル: 数値」の表示Surfaceを，数値が変わったときだけ組み立て直すクラス
+    """
+    def __init__(self, label: str, size: int, color: tuple[int, int, int]):
+        """
+        引数1 label：数値の前に表示するラベル文字列
+        引数2 size：文字サイズ
+        引数3 color：文字色
+        """
+        self.atlas = get_digit_atlas(size, color)
+        self.prefix = self.atlas.label(label)
+        self.value = None
+        self.image = None
+
+    def get_image(self, value) -> pg.Surface:
+        """
+        数値に対応する表示Surfaceを返す（前回と同じ数値ならキャッシュを返す）
+        引数 value：表示する数値
+        戻り値：表示Surface
+        """
+        if self.image is None or value != self.value or type(value) != type(self.value):
+            self.value = value
+            self.image = self.atlas.render(self.prefix, value)
+        return self.image
+
+
 class Score:
     """
     打ち落とした爆弾，敵機の数をスコアとして表示するクラス
@@ -332,10 +993,10 @@ class Score:
     敵機：10点
     """
     def __init__(self):
-        self.font = pg.font.Font(None, 50)
         self.color = (0, 0, 255)
         self.score = 0
-        self.image = self.font.render(f"Score: {self.score}", 0, self.color)
+        self.text = HudText("Score: ", 50, self.color)
+        self.image = self.text.get_image(self.score)
         self.rect = self.image.get_rect()
         self.rect.center = 100, HEIGHT-50
 
@@ -343,21 +1004,24 @@ class Score:
         self.score += add
 
     def update(self, screen: pg.Surface):
-        self.image = self.font.render(f"Score: {self.score}", 0, self.color)
+        self.image = self.text.get_image(self.score)  # スコアが変わったときだけ作り直す
         screen.blit(self.image, self.rect)
 class Reload:
     """
     時間を計測するして、表示するクラス
     """
+    label = "Reloadtime: "  # 数値の前に表示するラベル
+    size = 50  # 文字サイズ
+    color = (0, 0, 255)  # 文字色
+
     def __init__(self, start,fr):
         """
         start = 初期値
         fr = フレームレート
         """
-        self.font = pg.font.Font(None, 50)
-        self.color = (0, 0, 255)
         self.start = start//fr
-        self.image = self.font.render(f"Reloadtime: {self.start}", 0, self.color)
+        self.text = HudText(self.label, self.size, self.color)
+        self.image = self.text.get_image(self.start)
         self.rect = self.image.get_rect()
         self.rect.center = 125, HEIGHT-25 
 
@@ -365,7 +1029,7 @@ class Reload:
         self.start += add
 
     def update(self, screen: pg.Surface):
-        self.image = self.font.render(f"Reloadtime: {self.start}", 0, self.color)
+        self.image = self.text.get_image(self.start)  # 時間が変わったときだけ作り直す
         screen.blit(self.image, self.rect)
 
 class Finish:
@@ -373,14 +1037,13 @@ class Finish:
     プログラムを終わらせるためのボタン表示
     """
     def __init__(self):
-        self.font = pg.font.Font(None, 50)
+        self.font = get_font(50)
         self.color = (0, 0, 255)
-        self.image = self.font.render(f"Finish = Enter", 0, self.color)
+        self.image = self.font.render("Finish = Enter", 0, self.color)  # 文字列は変わらないので一度だけ描画
         self.rect = self.image.get_rect()
         self.rect.center = 1430, HEIGHT-50
 
     def update(self, screen: pg.Surface):
-        self.image = self.font.render(f"Finish = Enter", 0, self.color)
         screen.blit(self.image, self.rect)
 
 class Continue:
@@ -388,14 +1051,13 @@ class Continue:
     プログラムを続けるためのボタン表示
     """
     def __init__(self):
-        self.font = pg.font.Font(None, 50)
+        self.font = get_font(50)
         self.color = (0, 0, 255)
-        self.image = self.font.render(f"Continue = Space", 0, self.color)
+        self.image = self.font.render("Continue = Space", 0, self.color)  # 文字列は変わらないので一度だけ描画
         self.rect = self.image.get_rect()
         self.rect.center = 1410, HEIGHT-80
 
     def update(self, screen: pg.Surface):
-        self.image = self.font.render(f"Continue = Space", 0, self.color)
         screen.blit(self.image, self.rect)
 
 class Gravity(pg.sprite.Sprite):
@@ -413,11 +1075,11 @@ class Gravity(pg.sprite.Sprite):
         self.rect = self.image.get_rect()
         self.rect.centerx = bird.rect.centerx
         self.rect.centery = bird.rect.centery
-        self.life = life
+        self.life = life  # 消えるまでのステップ数（GameがSchedulerで削除する）
         #self.speed = bird.speed
     def update(self, ):#key_lst)これを追加すれば、球がついてくる機能を有効化できる。:
         """
-        以下は球がついてくるようになる追加機能である。
+        以下は球がついてくるようになる追加機能である。（Game.stepからは呼んでいない）
         sum_mv = [0, 0]
         for k, mv in Bird.delta.items():
             if key_lst[k]:
@@ -429,21 +1091,19 @@ class Gravity(pg.sprite.Sprite):
                 if key_lst[k]:
                     self.rect.move_ip(-self.speed*mv[0], -self.speed*mv[1])
         """
-        self.life -= 1
-        if self.life < 0:
-            self.kill()
 
 class fire(pg.sprite.Sprite): 
     "焼野原の追加"
     def __init__(self,bird: Bird,life : int):
          super().__init__()
-         self.image = pg.Surface((6800,900))
+         area = pg.Rect(0, 0, 6800, 900)
+         area.centerx = 0
+         area.centery = 900
+         self.rect = area.clip(pg.Rect(0, 0, WIDTH, HEIGHT))  # 画面に見える部分（画面の下半分）だけにする
+         self.image = pg.Surface(self.rect.size)
          color = (245,120,0)
-         pg.draw.rect(self.image,color,pg.Rect(0,0, 6800,900))
+         self.image.fill(color)
          self.image.set_alpha(200)
-         self.rect = self.image.get_rect()
-         self.rect.centerx = 0
-         self.rect.centery = 900
          self.life = life
     """
     def update(self):
@@ -452,196 +1112,1987 @@ class fire(pg.sprite.Sprite):
             self.kill() #fireグループからの削除
     """
 
-def main():
-    pg.display.set_caption("逆襲！エイリアン")
-    screen = pg.display.set_mode((WIDTH, HEIGHT))
-    bg_img = pg.image.load("ex05/fig/pg_bg.jpg")
-    clear_img = pg.image.load("ex05/fig/text_gameclear.png")
-    score = Score()
-    finish = Finish()
-    conti =Continue()
-    bg_img = pg.image.load("ex05/fig/pg_bg.jpg")
-    score = Score()
-    font1 = pygame.font.SysFont(None, 50)
-    bird = Bird(3, (900, 400))
-    hp = Hp(40, 800, 100, 4)
-    bombs = pg.sprite.Group()
-    beams = pg.sprite.Group()
-    exps = pg.sprite.Group()
-    emys = pg.sprite.Group()
-    Shields = pg.sprite.Group()
-    i = 0 #クリア後の分岐のための真偽値
-    fires = pg.sprite.Group()
-
-    gravity = pg.sprite.Group()
-    tmr = 0
-    clock = pg.time.Clock()
-    re = 0
-    count = 0
-    re_time = False
-    while True:
-        key_lst = pg.key.get_pressed()
-        shift_pressed = False
-        for event in pg.event.get():
-            if event.type == pg.QUIT:
-                return 0
-            if event.type == pg.KEYDOWN and event.key == pg.K_SPACE and (re ==0 or tmr/50>re+5) :#ビームを５回以上だした後に５秒たったら
-                beams.add(Beam(bird))
-                count += 1#出した数ビームの数
-                if count >= 5:#出したビームの数が５いじょうなら
-                    re = tmr/50#時間を記録
-                    re_time = Reload(re-tmr//50, 50)#Reloadクラスのインスタンス作成
-                    count = 0#出したビームの数を０にする
-                if pg.key.get_mods() & pg.KMOD_LSHIFT :
-                    count += 5#出した数ビームの数
-                    if count >= 5:
-                        count = 0
-                        re = tmr/50
-                        re_time = Reload(re-tmr//50, 50)
-                    shift_pressed = True
-            if event.type == pg.KEYDOWN and event.key == pg.K_CAPSLOCK:
-                if score.score >= 10 and len(Shields) == 0:
-                    Shields.add(Shield(bird,400))
-                    score.score -= 50
-
-            if event.type == pg.KEYDOWN and event.key == pg.K_RSHIFT and score.score >= 100:
-                bird.change_state("hyper",500)
-                score.score_up(-100)
-            if event.type == pg.KEYDOWN and event.key == pg.K_LSHIFT:
-                bird.speed = 20
-            if event.type == pg.KEYUP and event.key == pg.K_LSHIFT:
-                bird.speed = 10
-            if event.type == pg.KEYDOWN and event.key == pg.K_TAB and score.score >= 50:
-                score.score_up(-50)
-                gravity.add(Gravity(bird, 200, 500))
 
-            if event.type == pg.KEYDOWN and event.key == pg.K_RETURN:
-                pg.quit()
-                sys.exit()
-            if i != 0 and event.type == pg.KEYDOWN and event.key == pg.K_SPACE: #クリア後スペースを押すともう一度プレイできる
-                main()
 
-            if score.score >= 50 and len(fires) == 0:
-                    fires.add(fire(bird,400))
+class ProjectileEngine:
+    """
+    爆弾とビームの位置，移動量，大きさ，反射回数をNumPy配列で持ち，
+    移動・壁での反射（3回で消滅）・画面外判定を配列演算でまとめて行うクラス
+    Rectの移動（move_ip）と同じく移動量は整数に切り捨てるので，Bomb.update，Beam.updateと同じ結果になる
+    """
+    def __init__(self, capacity: int = 256):
+        """
+        引数 capacity：最初に確保する配列の大きさ（足りなくなったら倍にする）
+        """
+        self.sprites = []  # 配列の位置に対応するスプライト
+        self.free = []  # 空いている配列の位置
+        self.x = np.zeros(0, np.int32)  # 左端
+        self.y = np.zeros(0, np.int32)  # 上端
+        self.w = np.zeros(0, np.int32)  # 幅
+        self.h = np.zeros(0, np.int32)  # 高さ
+        self.dx = np.zeros(0, np.int32)  # 1フレームの横方向の移動量
+        self.dy = np.zeros(0, np.int32)  # 1フレームの縦方向の移動量
+        self.cnt = np.zeros(0, np.int32)  # 壁に当たった回数
+        self.bounce = np.zeros(0, bool)  # 壁で反射するか（爆弾：True，ビーム：False）
+        self.alive = np.zeros(0, bool)  # 使用中かどうか
+        self.grow(capacity)
+
+    def grow(self, capacity: int):
+        """
+        配列をcapacityの大きさに広げる
+        引数 capacity：新しい配列の大きさ
+        """
+        old = len(self.sprites)
+        for name in ("x", "y", "w", "h", "dx", "dy", "cnt", "bounce", "alive"):
+            arr = getattr(self, name)
+            new = np.zeros(capacity, arr.dtype)
+            new[:old] = arr
+            setattr(self, name, new)
+        self.sprites.extend([None]*(capacity-old))
+        self.free.extend(range(capacity-1, old-1, -1))
+
+    def add(self, spr: Projectile):
+        """
+        爆弾またはビームをエンジンに登録する
+        引数 spr：登録するBombまたはBeam
+        """
+        if not self.free:
+            self.grow(2*len(self.sprites))
+        i = self.free.pop()
+        self.sprites[i] = spr
+        self.x[i], self.y[i] = spr.rect.topleft
+        self.w[i], self.h[i] = spr.rect.size
+        self.dx[i] = int(spr.speed*spr.vx)
+        self.dy[i] = int(spr.speed*spr.vy)
+        self.cnt[i] = getattr(spr, "cnt", 0)
+        self.bounce[i] = isinstance(spr, Bomb)
+        self.alive[i] = True
+        spr.engine, spr.slot = self, i
+
+    def release(self, spr: Projectile):
+        """
+        削除されたスプライトの配列の位置を空ける
+        引数 spr：削除されたBombまたはBeam
+        """
+        i = spr.slot
+        if i is not None and self.sprites[i] is spr:
+            self.alive[i] = False
+            self.sprites[i] = None
+            self.free.append(i)
+        spr.engine, spr.slot = None, None
+
+    def step(self):
+        """
+        登録されているすべての爆弾とビームを1フレーム分動かし，消えるものを削除する
+        """
+        a = self.alive
+        self.x[a] += self.dx[a]
+        self.y[a] += self.dy[a]
+        yoko = (self.x >= 0) & (self.x+self.w <= WIDTH)  # 横方向に画面内か
+        tate = (self.y >= 0) & (self.y+self.h <= HEIGHT)  # 縦方向に画面内か
+        dead = a & ((self.bounce & (self.cnt == 3)) | (~self.bounce & ~(yoko & tate)))
+        flip_x = a & self.bounce & ~yoko & tate  # 左右の壁に当たったとき
+        flip_y = a & self.bounce & yoko & ~tate  # 上下の壁に当たったとき
+        self.dx[flip_x] *= -1
+        self.dy[flip_y] *= -1
+        self.cnt[flip_x | flip_y] += 1
+        sprites = self.sprites
+        for i, x, y in zip(np.flatnonzero(a).tolist(), self.x[a].tolist(), self.y[a].tolist()):
+            sprites[i].rect.topleft = x, y
+        for i in np.flatnonzero(dead).tolist():
+            sprites[i].kill()
+
+
+class ParticleSystem:
+    """
+    爆発エフェクトをパーティクルとしてNumPy配列にまとめて持ち，まとめて動かしてまとめて描画するクラス
+    1回の爆発は，Explosionと同じく10ステップごとに画像が切り替わる爆発画像1つと，飛び散る破片でできている
+    ゲームの乱数とは別の乱数を使うので，パーティクルを出してもゲームの進み方は変わらない
+    """
+    def __init__(self, seed: int | None = None, capacity: int = MAX_PARTICLES):
+        """
+        引数1 seed：破片の飛び方の乱数の種
+        引数2 capacity：同時に存在できるパーティクルの最大数（超えた分は出さない）
+        """
+        self.capacity = capacity
+        self.x = np.zeros(capacity, np.float32)  # 中心のx座標
+        self.y = np.zeros(capacity, np.float32)  # 中心のy座標
+        self.vx = np.zeros(capacity, np.float32)  # 1ステップの横方向の移動量
+        self.vy = np.zeros(capacity, np.float32)  # 1ステップの縦方向の移動量
+        self.life = np.zeros(capacity, np.int32)  # 残り寿命（負になったら消える）
+        self.max_life = np.ones(capacity, np.int32)  # 最初の寿命
+        self.base = np.zeros(capacity, np.int32)  # 画像の表の先頭の番号（0：爆発画像）
+        self.img = np.zeros(capacity, np.int32)  # 今描く画像の番号
+        self.n = 0  # 使用中のパーティクルの数（配列の先頭から詰めて使う）
+        self.limit = capacity  # 同時に存在できる数（QualityGovernorが減らす）
+        self.debris = True  # 破片を出すかどうか（QualityGovernorが止める）
+        self.half = None  # 画像の表の番号ごとの(幅, 高さ)の半分
+        self.reset(seed)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def reset(self, seed: int | None = None):
+        """
+        すべてのパーティクルを消し，乱数を初期化する
+        """
+        self.n = 0
+        self.rng = np.random.default_rng(seed)
 
-            
-        screen.blit(bg_img, [0, 0])
+    def burst(self, center: tuple[int, int], life: int, debris: int | None = None):
+        """
+        爆発画像1つと，まわりに飛び散る破片を出す
+        引数1 center：爆発の中心座標
+        引数2 life：爆発画像の寿命（Explosionのlifeと同じ）
+        引数3 debris：破片の数（Noneのときは寿命に応じて決める）
+        """
+        if not self.debris:
+            debris = 0
+        elif debris is None:
+            debris = life//4
+        num = min(1+debris, self.limit-self.n)
+        if num <= 0:
+            return
+        s = slice(self.n, self.n+num)
+        self.x[s], self.y[s] = center
+        angle = self.rng.uniform(0, 2*math.pi, num)
+        speed = self.rng.uniform(1, 7, num)
+        self.vx[s] = np.cos(angle)*speed
+        self.vy[s] = np.sin(angle)*speed
+        self.life[s] = self.rng.integers(15, 40, num)
+        nkinds = len(PARTICLE_COLORS)*len(PARTICLE_SIZES)
+        self.base[s] = 2+self.rng.integers(0, nkinds, num)*PARTICLE_FADE
+        i = self.n  # 先頭は爆発画像（動かない）
+        self.vx[i] = self.vy[i] = 0
+        self.life[i] = life
+        self.base[i] = 0
+        self.max_life[s] = self.life[s]
+        self.n += num
+        self.update_imgs(s)
+
+    def update_imgs(self, s: slice):
+        """
+        残り寿命から描く画像の番号を決める
+        爆発画像は残り寿命//10の偶奇で切り替え，破片は残り寿命が短いほど薄い画像にする
+        """
+        life, base = self.life[s], self.base[s]
+        fade = np.minimum(np.maximum(life, 0)*PARTICLE_FADE//self.max_life[s], PARTICLE_FADE-1)
+        self.img[s] = base+np.where(base == 0, life//10%2, fade)
 
-        if tmr%200 == 0:  # 200フレームに1回，敵機を出現させる
-            emys.add(Enemy())
+    def step(self):
+        """
+        すべてのパーティクルを1ステップ分動かし，寿命が尽きたものを消す（配列は前に詰める）
+        """
+        n = self.n
+        if not n:
+            return
+        s = slice(0, n)
+        self.x[s] += self.vx[s]
+        self.y[s] += self.vy[s]
+        self.vx[s] *= 0.94  # 空気抵抗
+        self.vy[s] *= 0.94
+        self.vy[s] += 0.15*(self.base[s] > 0)  # 破片だけ落ちていく
+        self.life[s] -= 1
+        keep = self.life[s] >= 0
+        k = int(keep.sum())
+        if k < n:
+            for arr in (self.x, self.y, self.vx, self.vy, self.life, self.max_life, self.base):
+                arr[:k] = arr[s][keep]
+            self.n = n = k
+        self.update_imgs(slice(0, n))
+
+    def half_sizes(self) -> "np.ndarray":
+        """
+        画像の表の番号ごとの(幅, 高さ)の半分を返す（一度だけ作る）
+        """
+        imgs = get_particle_imgs()
+        if self.half is None or len(self.half) != len(imgs):
+            self.half = np.array([[im.get_width()//2, im.get_height()//2] for im in imgs], np.float32)
+        return self.half
 
-        for emy in emys:
-            if emy.state == "stop" and tmr%emy.interval == 0:
-                # 敵機が停止状態に入ったら，intervalに応じて爆弾投下
-                bombs.add(Bomb(emy, bird))
+    def snapshot(self) -> "ParticleSystem":
+        """
+        描画に使う配列の使用中の部分だけを写した複製を返す（--pipelineで描画のスレッドに渡す．drawにだけ使う）
+        """
+        self.half_sizes()
+        snap = copy.copy(self)
+        n = self.n
+        for name in ("x", "y", "vx", "vy", "img"):
+            setattr(snap, name, getattr(self, name)[:n].copy())
+        return snap
+
+    def draw(self, screen, alpha: float = 1.0):
+        """
+        すべてのパーティクルを1回のblitsで描画する
+        引数1 screen：描画先（Rendererまたは画面Surface）
+        引数2 alpha：直前のステップの位置と今の位置の間の補間の割合
+        """
+        n = self.n
+        if not n:
+            return
+        imgs = get_particle_imgs()
+        img = self.img[:n]
+        half = self.half_sizes()[img]
+        back = 1.0-alpha  # 今の位置から直前のステップの位置の方へ戻す割合
+        x = self.x[:n]-self.vx[:n]*back-half[:, 0]
+        y = self.y[:n]-self.vy[:n]*back-half[:, 1]
+        scale = getattr(screen, "scale", 1.0)
+        if scale != 1.0:  # 内部解像度で描くときは，画像と座標をまとめて変換して渡す（1つずつ変換させない）
+            imgs = [screen.fit(im) for im in imgs]
+            x *= scale
+            y *= scale
+        seq = list(zip(map(imgs.__getitem__, img.tolist()), zip(x.astype(np.int32).tolist(), y.astype(np.int32).tolist())))
+        if scale != 1.0:
+            screen.blits(seq, fitted=True)
+        else:
+            screen.blits(seq)
 
-        for emy in pg.sprite.groupcollide(emys, beams, True, True).keys():
-            exps.add(Explosion(emy, 100))  # 爆発エフェクト
-            score.score_up(10)  # 10点アップ
-            bird.change_img(6, screen)  # こうかとん喜びエフェクト
 
-        for bomb in pg.sprite.groupcollide(bombs, beams, True, True).keys():
-            exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-            score.score_up(1)  # 1点アップ
+class SpatialHash:
+    """
+    画面を一様な格子に区切り，スプライトを重なるセルに登録するクラス
+    衝突判定の相手を近くのセルにいるものだけに絞り込むのに使う
+    """
+    def __init__(self, cell: int = 128):
+        """
+        引数 cell：セル1辺の大きさ（ピクセル）
+        """
+        self.cell = cell
+        self.cells = {}  # (セルx, セルy)をキーとしたスプライトのリストの辞書
 
-        for bomb in pg.sprite.spritecollide(bird, bombs, True):
-            if bird.state == "hyper":
-                exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-                score.score_up(1)  # 1点アップ
-            
-            else:
-                exps.add(Explosion(bomb, 50)) #爆発エフェクト
-                hp.hp -= 1 #㏋　ー１
-                if hp.hp == 0: #HPがなくなったら
-                    bird.change_img(8, screen) # こうかとん悲しみエフェクト
-                    score.update(screen)
-                    pg.display.update()
-                    time.sleep(2)
-                    return
+    def clear(self):
+        self.cells.clear()
 
-        for bomb in pg.sprite.groupcollide(bombs,gravity, True, False).keys():
-            exps.add(Explosion(bomb, 50))
-
-        if len(pg.sprite.spritecollide(bird, bombs, True)) != 0:
-            exps.add(Explosion(bomb, 50)) #爆発エフェクト
-            hp.hp -= 1 #HP -1
-            if hp.hp == 0: #HPがなくなったら
-                bird.change_img(8, screen) # こうかとん悲しみエフェクト
-                score.update(screen)
-                pg.display.update()
-                time.sleep(2)
-                return
-        
-        if len(pg.sprite.spritecollide(bird, fires, True)) != 0:#こうかとんが火（オレンジの四角）に触れたら負け
-            bird.change_img(10, screen) # 焼き鳥の画像
-            score.update(screen)
-            text1 = font1.render("grilled chicken", True, (255,64,64))
-            screen.blit(text1, (500,500))#火にあたって負けた場合のメッセージ
-            pg.display.update()
-            time.sleep(2)
-            return
-        
-        if len(pg.sprite.spritecollide(bird, emys, True)) != 0: #こうかとんが敵に触れたら負け
-            bird.change_img(8, screen) # こうかとん悲しみエフェクト
-            score.update(screen)
-            pg.display.update()
-            time.sleep(2)
-            return
-        
-        for bomb in pg.sprite.groupcollide(bombs, Shields, True, False).keys():
-            exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-            score.score_up(1)
+    def cell_range(self, rect: pg.Rect) -> tuple[range, range]:
+        """
+        rectが重なるセルの範囲を返す
+        引数 rect：調べる領域
+        戻り値：横方向，縦方向のセル番号のrange
+        """
+        c = self.cell
+        return range(rect.left//c, (rect.right-1)//c+1), range(rect.top//c, (rect.bottom-1)//c+1)
+
+    def insert(self, spr: pg.sprite.Sprite):
+        """
+        スプライトを重なるすべてのセルに登録する
+        引数 spr：登録するスプライト
+        """
+        xs, ys = self.cell_range(spr.rect)
+        for cx in xs:
+            for cy in ys:
+                self.cells.setdefault((cx, cy), []).append(spr)
+
+    def query(self, rect: pg.Rect) -> list[pg.sprite.Sprite]:
+        """
+        rectと同じセルに登録されているスプライトを重複なしで返す
+        引数 rect：調べる領域
+        戻り値：候補のスプライトのリスト（重なっているかはまだ判定していない）
+        """
+        found = {}
+        xs, ys = self.cell_range(rect)
+        for cx in xs:
+            for cy in ys:
+                for spr in self.cells.get((cx, cy), ()):
+                    found[spr] = None
+        return list(found)
+
+
+class Timer:
+    """
+    Schedulerに登録した1つの予定
+    """
+    def __init__(self, tick: int, order: int, func, args: tuple, period: int, count: int | None):
+        self.tick = tick  # 次に実行するステップ
+        self.order = order  # 同じステップの予定を実行する順番（小さいほど先）
+        self.func = func
+        self.args = args
+        self.period = period  # 繰り返す間隔（0なら1回だけ）
+        self.count = count  # 残りの実行回数（Noneなら取り消すまで繰り返す）
+        self.active = True
+
+    def cancel(self):
+        self.active = False
+
+
+class Scheduler:
+    """
+    ステップ番号を鍵としたヒープで予定を管理するクラス
+    毎ステップすべてのスプライトを調べる代わりに，実行するステップになった予定だけを取り出して実行する
+    同じステップの予定は(order, 登録した順)の順に実行する
+    """
+    def __init__(self):
+        self.heap = []  # (ステップ, order, 登録番号, Timer)のヒープ
+        self.seq = 0  # 登録番号
+
+    def clear(self):
+        self.heap.clear()
+
+    def push(self, timer: Timer):
+        heapq.heappush(self.heap, (timer.tick, timer.order, self.seq, timer))
+        self.seq += 1
+
+    def at(self, tick: int, func, *args, order: int = 0) -> Timer:
+        """
+        指定したステップにfunc(*args)を1回実行する
+        引数1 tick：実行するステップ
+        引数2 func：実行する関数
+        引数3以降：funcの引数
+        戻り値：取り消しに使うTimer
+        """
+        timer = Timer(tick, order, func, args, 0, 1)
+        self.push(timer)
+        return timer
+
+    def every(self, first: int, period: int, func, *args, count: int | None = None, order: int = 0) -> Timer:
+        """
+        firstステップからperiodステップごとにfunc(*args)を実行する
+        引数1 first：最初に実行するステップ
+        引数2 period：繰り返す間隔
+        引数3 func：実行する関数
+        引数4以降：funcの引数
+        戻り値：取り消しに使うTimer
+        """
+        timer = Timer(first, order, func, args, period, count)
+        self.push(timer)
+        return timer
+
+    def run(self, now: int):
+        """
+        nowステップまでに実行する予定をすべて実行する
+        引数 now：今のステップ
+        """
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            timer = heapq.heappop(heap)[3]
+            if not timer.active:
+                continue
+            timer.func(*timer.args)
+            if timer.count is not None:
+                timer.count -= 1
+            if timer.active and timer.period and timer.count != 0:
+                timer.tick += timer.period
+                self.push(timer)
+            else:
+                timer.active = False
+
+
+def next_multiple(tick: int, period: int) -> int:
+    """
+    tick以上で最小のperiodの倍数を返す（tmr%period == 0 になる最初のステップ）
+    """
+    return -(-tick//period)*period
+
+
+class FrameProfiler:
+    """
+    1フレームの処理を段階（入力，出現，衝突，各グループのupdate/draw，画面反映など）ごとに計測するクラス
+    段階の区切りでmarkを呼ぶと，前の区切りからの経過時間がその段階の時間になる
+    """
+    def __init__(self, enabled: bool = False, window: int = 500, trace_len: int = 30000):
+        """
+        引数1 enabled：計測するかどうか（Falseのときmarkなどは何もしない）
+        引数2 window：パーセンタイルを計算する直近のフレーム数
+        引数3 trace_len：書き出し用に取っておくフレーム数
+        """
+        self.enabled = enabled
+        self.window = window
+        self.stages = {}  # 段階名をキーとした直近の計測時間（ミリ秒）のdeque
+        self.trace = deque(maxlen=trace_len)  # フレームごとの{段階名: ミリ秒}の記録
+        self.current = {}  # 今フレームの計測時間
+        self.last = 0.0  # 前の区切りの時刻
+        self.frame = 0  # 計測したフレーム数
+        self.overlay = None  # 画面に重ねる計測結果のSurface
+
+    def begin_frame(self):
+        """
+        フレームの計測を始める
+        """
+        if self.enabled:
+            self.current = {}
+            self.last = time.perf_counter()
+
+    def mark(self, name: str):
+        """
+        前の区切りから今までの時間を段階nameの時間として記録する
+        引数 name：段階名
+        """
+        if self.enabled:
+            now = time.perf_counter()
+            self.current[name] = self.current.get(name, 0.0)+(now-self.last)*1000
+            self.last = now
+
+    def end_frame(self):
+        """
+        フレームの計測を終え，段階ごとの記録に加える
+        """
+        if not self.enabled:
+            return
+        self.current["total"] = sum(self.current.values())-self.current.get("wait", 0.0)
+        for name, ms in self.current.items():
+            if name not in self.stages:
+                self.stages[name] = deque(maxlen=self.window)
+            self.stages[name].append(ms)
+        self.trace.append((self.frame, self.current))
+        self.frame += 1
+        if self.frame % 25 == 0:
+            self.overlay = None  # 計測結果の表示を作り直す
+
+    def percentiles(self, name: str) -> tuple[float, float, float]:
+        """
+        段階nameの直近の計測時間のパーセンタイルを返す
+        引数 name：段階名
+        戻り値：p50，p95，p99（ミリ秒）のタプル
+        """
+        values = sorted(self.stages.get(name, ()))
+        if not values:
+            return 0.0, 0.0, 0.0
+        return tuple(values[min(int(len(values)*q), len(values)-1)] for q in (0.5, 0.95, 0.99))
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """
+        段階ごとのパーセンタイルを辞書で返す
+        戻り値：段階名をキーとした{"p50", "p95", "p99"}の辞書
+        """
+        return {name: dict(zip(("p50", "p95", "p99"), self.percentiles(name))) for name in self.stages}
+
+    def report(self) -> str:
+        """
+        取っておいたフレーム全体での段階ごとのp50/p95/p99を表示用の文字列にする（終了時に表示する）
+        戻り値：1段階1行の文字列
+        """
+        lines = [f"段階ごとの処理時間（{len(self.trace)}フレーム）："]
+        for name in self.stages:
+            values = sorted(frame[name] for _, frame in self.trace if name in frame)
+            if not values:  # 取っておいたフレームにはもう残っていない段階（ゲームオーバー画面が長く続いたときのステップの段階など）
+                continue
+            p50, p95, p99 = (values[min(int(len(values)*q), len(values)-1)] for q in (0.5, 0.95, 0.99))
+            lines.append(f"{name:>20} p50 {p50:7.3f} p95 {p95:7.3f} p99 {p99:7.3f} ms")
+        return "\n".join(lines)
+
+    def get_overlay(self) -> pg.Surface:
+        """
+        計測結果を画面に重ねるためのSurfaceを返す（25フレームに1回作り直す）
+        戻り値：計測結果のSurface
+        """
+        if self.overlay is None:
+            font = get_font(22)
+            lines = [font.render(f"{name:>20} p50 {p50:6.2f} p95 {p95:6.2f} p99 {p99:6.2f} ms", True, (255, 255, 255))
+                     for name, (p50, p95, p99) in ((n, self.percentiles(n)) for n in self.stages)]
+            height = sum(line.get_height() for line in lines)
+            width = max((line.get_width() for line in lines), default=0)
+            self.overlay = pg.Surface((width+10, height+10), pg.SRCALPHA)
+            self.overlay.fill((0, 0, 0, 160))
+            y = 5
+            for line in lines:
+                self.overlay.blit(line, (5, y))
+                y += line.get_height()
+        return self.overlay
+
+    def dump(self, path: str):
+        """
+        フレームごとの計測結果をJSONまたはCSV（拡張子で決める）に書き出す
+        引数 path：書き出すファイル名
+        """
+        names = list(self.stages)
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["frame", *names])
+                for frame, times in self.trace:
+                    writer.writerow([frame, *(f"{times.get(name, 0.0):.4f}" for name in names)])
+        else:
+            with open(path, "w") as f:
+                json.dump({"summary": self.summary(),
+                           "frames": [dict(frame=frame, **times) for frame, times in self.trace]}, f)
+
+
+class LatencyMeter:
+    """
+    入力を読んだ時刻から，その入力で進めたステップを画面に反映し終えるまでの時間（入力遅延）をフレームごとに記録するクラス
+    ステップを進めなかったフレームの入力は次にステップを進めたフレームまで待つので，そのときは最初に読んだ時刻から数える
+    （pygameのイベントには時刻がないので，イベントキューで待っていた時間は含まない）
+    """
+    def __init__(self, trace_len: int = 30000):
+        """
+        引数 trace_len：取っておくフレーム数
+        """
+        self.trace = deque(maxlen=trace_len)  # フレームごとの(フレーム番号, 入力遅延（ミリ秒）)
+        self.frame = 0  # 記録したフレーム数
+
+    def record(self, stamp: float, presented: float):
+        """
+        1フレーム分の入力遅延を記録する
+        引数1 stamp：入力を読んだ時刻
+        引数2 presented：画面に反映し終えた時刻
+        """
+        self.trace.append((self.frame, (presented-stamp)*1000))
+        self.frame += 1
+
+    def percentiles(self) -> tuple[float, float, float, float]:
+        """
+        戻り値：入力遅延のp50，p95，p99，最大（ミリ秒）のタプル
+        """
+        values = sorted(ms for _, ms in self.trace)
+        if not values:
+            return 0.0, 0.0, 0.0, 0.0
+        return (*(values[min(int(len(values)*q), len(values)-1)] for q in (0.5, 0.95, 0.99)), values[-1])
+
+    def report(self) -> str:
+        p50, p95, p99, worst = self.percentiles()
+        return f"入力から画面反映まで（{len(self.trace)}フレーム）：p50 {p50:.2f}  p95 {p95:.2f}  p99 {p99:.2f}  max {worst:.2f} ms"
+
+    def dump(self, path: str):
+        """
+        フレームごとの入力遅延をCSVに書き出す
+        引数 path：書き出すファイル名
+        """
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["frame", "latency_ms"])
+            writer.writerows((frame, f"{ms:.4f}") for frame, ms in self.trace)
+
+
+class QualityGovernor:
+    """
+    直近のフレームの処理時間を見て，予算（1ステップの時間）を超えそうなら画質レベルを1つ上げて見た目の処理を減らし，
+    十分に余裕があれば1つ下げて元に戻すクラス（ゲームの進み方には影響しない見た目の部分だけを変える）
+    上げる・下げるのしきい値を離し，変えた後はholdフレーム待つので，レベルが行ったり来たりしない
+    """
+    def __init__(self, budget_ms: float = SIM_DT*1000, window: int = 30, hold: int = 50, fixed: int | None = None):
+        """
+        引数1 budget_ms：1フレームの処理時間の予算（ミリ秒）
+        引数2 window：判定に使う直近のフレーム数
+        引数3 hold：レベルを変えてから次に変えるまでに待つフレーム数
+        引数4 fixed：レベルを固定するときのレベル（Noneのときは自動で変える）
+        """
+        self.budget = budget_ms
+        self.hold = hold
+        self.fixed = fixed
+        self.level = fixed or 0
+        self.times = deque(maxlen=window)  # 直近のフレームの処理時間（ミリ秒）
+        self.since = 0  # 前にレベルを変えてからのフレーム数
+        self.exps_cap = None  # 画質レベル0のときのExplosionの上限
+
+    def update(self, work_ms: float) -> bool:
+        """
+        1フレームの処理時間（clock.tickで待った時間を除く）を記録し，必要ならレベルを変える
+        引数 work_ms：処理時間（ミリ秒）
+        戻り値：レベルを変えたかどうか
+        """
+        if self.fixed is not None:
+            return False
+        self.times.append(work_ms)
+        self.since += 1
+        if len(self.times) < self.times.maxlen or self.since < self.hold:
+            return False
+        slow = sorted(self.times)[int(len(self.times)*0.9)]  # 遅い方から1割のフレームの処理時間
+        if slow > self.budget*0.9 and self.level < len(QUALITY_LEVELS)-1:
+            self.level += 1
+        elif slow < self.budget*0.5 and self.level > 0:
+            self.level -= 1
+        else:
+            return False
+        self.since = 0
+        self.times.clear()
+        return True
+
+    def apply(self, game: "Game", renderer: "Renderer"):
+        """
+        今のレベルをGameとRendererに反映する
+        ハイパーモードのlaplacianは画像ごとに一度だけ計算してキャッシュ済みで，焼野原も背景に一度だけ合成済みなので，
+        毎フレームの処理には含まれず，ここでは変えない
+        """
+        level = self.level
+        if self.exps_cap is None:
+            self.exps_cap = game.caps["exps"]
+        shrink = 4 if level >= 3 else 1
+        game.caps["exps"] = min(self.exps_cap, QUALITY_EXPS//shrink) if level >= 1 else self.exps_cap
+        if game.particles is not None:
+            limit = game.particles.capacity
+            game.particles.limit = min(limit, QUALITY_PARTICLES//shrink) if level >= 1 else limit
+            game.particles.debris = level < 3
+        renderer.alpha_effects = level < 2
+
+    def describe(self) -> str:
+        return f"画質レベル {self.level}：{QUALITY_LEVELS[self.level]}"
+
+
+class FrameInput:
+    """
+    1フレーム分の入力のスナップショット
+    シミュレーション（Game.step）はpg.keyやpg.eventを直接読まず，これだけを参照する
+    """
+    def __init__(self, keys: dict[int, bool], events: list[tuple[int, int]], mods: int = 0, quit: bool = False,
+                 stamp: float = 0.0):
+        """
+        引数1 keys：押下中かどうかの真理値辞書（キーはBird.deltaのキー）
+        引数2 events：(イベントの種類, キー)タプルのリスト（KEYDOWN/KEYUPのみ）
+        引数3 mods：修飾キーの状態（pg.key.get_modsの値）
+        引数4 quit：ウィンドウが閉じられたかどうか
+        引数5 stamp：入力を読んだ時刻（time.perf_counterの値．入力遅延の計測に使う）
+        """
+        self.keys = keys
+        self.events = events
+        self.mods = mods
+        self.quit = quit
+        self.stamp = stamp
+
+    def pressed(self, key: int) -> bool:
+        """
+        このフレームでkeyが押されたかどうかを返す
+        引数 key：キー
+        戻り値：KEYDOWNイベントがあればTrue
+        """
+        return (pg.KEYDOWN, key) in self.events
+
+
+def read_input() -> FrameInput:
+    """
+    pygameのイベントキューとキー状態を読み，FrameInputにまとめる
+    キー状態はイベントキューを読んだ（SDLが状態を更新した）後に読むので，このフレームに押したキーも反映される
+    戻り値：今フレームの入力
+    """
+    events = []
+    quit = False
+    for event in pg.event.get():
+        if event.type == pg.QUIT:
+            quit = True
+        elif event.type in (pg.KEYDOWN, pg.KEYUP):
+            events.append((event.type, event.key))
+    key_lst = pg.key.get_pressed()
+    keys = {k: bool(key_lst[k]) for k in Bird.delta}
+    return FrameInput(keys, events, pg.key.get_mods(), quit, time.perf_counter())
+
+
+def wait_until(deadline: float, busy: bool = False):
+    """
+    時刻deadline（time.perf_counterの値）まで待つ
+    引数1 deadline：待ち終える時刻
+    引数2 busy：Trueのときは，スリープの誤差（OSによっては数ミリ秒）で遅れないよう，最後のBUSY_WAIT_MARGIN秒は空回りして待つ
+    """
+    rest = deadline-time.perf_counter()-(BUSY_WAIT_MARGIN if busy else 0.0)
+    if rest > 0:
+        time.sleep(rest)
+    if busy:
+        while time.perf_counter() < deadline:
+            pass
+
+
+def random_input(rng: random.Random) -> FrameInput:
+    """
+    負荷試験用に，乱数でそれらしい入力を作る
+    引数 rng：乱数生成器
+    戻り値：今フレームの入力
+    """
+    keys = {k: rng.random() < 0.3 for k in Bird.delta}
+    events = []
+    if rng.random() < 0.1:
+        events.append((pg.KEYDOWN, rng.choice([pg.K_SPACE, pg.K_SPACE, pg.K_CAPSLOCK, pg.K_TAB, pg.K_RSHIFT])))
+    return FrameInput(keys, events)
+
+
+REPLAY_MAGIC = b"KKTN"  # 入力記録ファイルの先頭の目印
+REPLAY_VERSION = 1  # 入力記録ファイルの形式の版
+REPLAY_HEADER = struct.Struct("<4sBQH")  # 目印，版，乱数の種，設定JSONの長さ
+REPLAY_FRAME = struct.Struct("<BHB")  # 押下中キーのビット，修飾キー，イベント数
+REPLAY_EVENT = struct.Struct("<BI")  # イベントの種類（0：KEYDOWN，1：KEYUP），キー
+TELEMETRY_MAGIC = b"KKTL"  # テレメトリファイルの先頭の目印
+TELEMETRY_VERSION = 1  # テレメトリファイルの形式の版
+TELEMETRY_HEADER = struct.Struct("<4sBxxxQIIQ")  # 目印，版，乱数の種，記録できるステップ数，1レコードのバイト数，書いたレコード数
+TELEMETRY_COUNT_OFFSET = TELEMETRY_HEADER.size-8  # ヘッダ中の書いたレコード数の位置
+TELEMETRY_SLOTS = {"bombs": 32, "beams": 32, "emys": 8}  # 1レコードに位置を入れるスプライトの数（超えた分は数だけ記録する）
+TELEMETRY_FIELDS = [  # 1ステップ分のレコードの(名前, structの型, 個数)（この順に隙間なく並べる）
+    ("step", "I", 1),  # ゲームのステップ数（Game.tmr）
+    ("time", "f", 1),  # 記録を始めてからの経過秒数
+    ("frame_ms", "f", 1),  # このステップを進めたフレームの1フレームの時間（ミリ秒）
+    ("hp", "i", 1),
+    ("score", "i", 1),
+    ("state", "B", 1),  # 0：プレイ中，1：ゲームクリア，2：ゲームオーバー
+    ("count", "B", 1),  # リロードまでに撃ったビームの数
+    ("reload", "f", 1),  # リロードの残り秒数
+    ("bird", "h", 2),  # こうかとんの中心のx，y
+    ("num_bombs", "H", 1),
+    ("num_beams", "H", 1),
+    ("num_emys", "H", 1),
+    *((name, "h", 2*num) for name, num in TELEMETRY_SLOTS.items()),  # 中心のx，yを並べたもの（空きは0）
+]
+TELEMETRY_RECORD = struct.Struct("<"+"".join(f"{num}{code}" for _, code, num in TELEMETRY_FIELDS))
+TELEMETRY_STATES = {"playing": 0, "clear": 1, "over": 2}
+
+
+class InputRecorder:
+    """
+    ゲームに渡したFrameInputを1フレームずつバイナリで書き出すクラス
+    乱数の種とグループの上限も記録するので，同じ入力でゲームを完全に再現できる
+    当たり判定のMaskのハッシュ（mask_signature）も記録し，再生するときに違えば再生しない
+    """
+    def __init__(self, path: str, seed: int, caps: dict[str, int]):
+        """
+        引数1 path：書き出すファイル名
+        引数2 seed：ゲームの乱数の種
+        引数3 caps：ゲームのグループごとの上限
+        """
+        self.file = open(path, "wb")
+        config = json.dumps({"caps": caps, "masks": mask_signature()}).encode()
+        self.file.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, seed, len(config)))
+        self.file.write(config)
+
+    def write(self, inp: FrameInput):
+        """
+        1フレーム分の入力を書き出す
+        引数 inp：ゲームに渡した入力
+        """
+        bits = sum(1 << i for i, k in enumerate(Bird.delta) if inp.keys.get(k))
+        self.file.write(REPLAY_FRAME.pack(bits, inp.mods & 0xFFFF, len(inp.events)))
+        for ev_type, key in inp.events:
+            self.file.write(REPLAY_EVENT.pack(0 if ev_type == pg.KEYDOWN else 1, key))
+
+    def close(self):
+        self.file.close()
+
+
+def read_replay(path: str) -> tuple[int, dict[str, int], list[FrameInput]]:
+    """
+    InputRecorderで書き出したファイルを読み込む（当たり判定のMaskが記録したときと違えばValueError）
+    引数 path：読み込むファイル名
+    戻り値：乱数の種，グループごとの上限，フレームごとのFrameInputのリスト
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, seed, config_len = REPLAY_HEADER.unpack_from(data, 0)
+    if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+        raise ValueError(f"入力記録ファイルではありません：{path}")
+    pos = REPLAY_HEADER.size
+    config = json.loads(data[pos:pos+config_len])
+    if "masks" in config and config["masks"] != mask_signature():  # 当たり判定が違うと同じ入力でも同じゲームにならない
+        raise ValueError(f"記録したときと当たり判定の画像が違うので再生できません：{path}")
+    pos += config_len
+    inputs = []
+    while pos < len(data):
+        bits, mods, num = REPLAY_FRAME.unpack_from(data, pos)
+        pos += REPLAY_FRAME.size
+        events = []
+        for _ in range(num):
+            ev_type, key = REPLAY_EVENT.unpack_from(data, pos)
+            pos += REPLAY_EVENT.size
+            events.append((pg.KEYDOWN if ev_type == 0 else pg.KEYUP, key))
+        keys = {k: bool(bits >> i & 1) for i, k in enumerate(Bird.delta)}
+        inputs.append(FrameInput(keys, events, mods))
+    return seed, config["caps"], inputs
+
+
+class TelemetryWriter:
+    """
+    1ステップごとのゲームの状態（HP，スコア，リロード，数と位置など）を固定長のバイナリレコードで書き出すクラス
+    ファイルはcapacityステップ分を最初に確保してメモリマップし，いっぱいになったら古いレコードから上書きする（リングバッファ）
+    書いたレコード数は毎回ヘッダに書くので，途中で落ちてもそこまでは読める
+    """
+    def __init__(self, path: str, seed: int, capacity: int = SIM_FPS*3600):
+        """
+        引数1 path：書き出すファイル名
+        引数2 seed：ゲームの乱数の種
+        引数3 capacity：記録できるステップ数（既定値は1時間分）
+        """
+        self.capacity = capacity
+        self.count = 0  # 書いたレコード数（capacityを超えても数え続ける）
+        self.start = time.perf_counter()
+        self.file = open(path, "w+b")
+        self.file.truncate(TELEMETRY_HEADER.size+capacity*TELEMETRY_RECORD.size)
+        self.buf = mmap.mmap(self.file.fileno(), 0)
+        TELEMETRY_HEADER.pack_into(self.buf, 0, TELEMETRY_MAGIC, TELEMETRY_VERSION, seed, capacity,
+                                   TELEMETRY_RECORD.size, 0)
+
+    def write(self, game: "Game", frame_ms: float):
+        """
+        1ステップ分のレコードを書き出す
+        引数1 game：ステップを進めた直後のGame
+        引数2 frame_ms：このステップを進めたフレームの時間（ミリ秒）
+        """
+        values = [game.tmr, time.perf_counter()-self.start, frame_ms, game.hp.hp, game.score.score,
+                  TELEMETRY_STATES[game.state], game.count,
+                  max(game.re+5-game.tmr/SIM_FPS, 0) if game.re else 0, *game.bird.rect.center,
+                  len(game.bombs), len(game.beams), len(game.emys)]
+        for name, num in TELEMETRY_SLOTS.items():
+            sprites = getattr(game, name).sprites()[:num]
+            values.extend([v for spr in sprites for v in spr.rect.center])
+            values.extend([0]*(2*(num-len(sprites))))
+        pos = TELEMETRY_HEADER.size+self.count % self.capacity*TELEMETRY_RECORD.size
+        TELEMETRY_RECORD.pack_into(self.buf, pos, *values)
+        self.count += 1
+        struct.pack_into("<Q", self.buf, TELEMETRY_COUNT_OFFSET, self.count)
+
+    def close(self):
+        self.buf.close()
+        self.file.close()
+
+
+def telemetry_dtype() -> "np.dtype":
+    """
+    TELEMETRY_FIELDSと同じ並びのNumPyの構造化dtypeを返す（爆弾・ビーム・敵機の位置は(個数, 2)の配列になる）
+    """
+    types = {"I": "<u4", "i": "<i4", "H": "<u2", "h": "<i2", "B": "u1", "f": "<f4"}
+    fields = []
+    for name, code, num in TELEMETRY_FIELDS:
+        if num == 1:
+            fields.append((name, types[code]))
+        elif name in TELEMETRY_SLOTS:
+            fields.append((name, types[code], (num//2, 2)))
+        else:
+            fields.append((name, types[code], (num,)))
+    return np.dtype(fields)
+
+
+def read_telemetry(path: str) -> tuple[dict, "np.ndarray"]:
+    """
+    TelemetryWriterで書き出したファイルをメモリマップしてNumPyの構造化配列として読み込む
+    引数 path：読み込むファイル名
+    戻り値：ヘッダの辞書（seed，capacity，count），古い順に並べたレコードの配列
+           （リングが一周していなければファイルをそのまま見る配列，一周していれば並べ替えたコピー）
+    """
+    if np is None:
+        raise RuntimeError("テレメトリの読み込みにはNumPyが必要です")
+    with open(path, "rb") as f:
+        magic, version, seed, capacity, size, count = TELEMETRY_HEADER.unpack(f.read(TELEMETRY_HEADER.size))
+    dtype = telemetry_dtype()
+    if magic != TELEMETRY_MAGIC or version != TELEMETRY_VERSION or size != dtype.itemsize:
+        raise ValueError(f"テレメトリファイルではありません：{path}")
+    header = {"seed": seed, "capacity": capacity, "count": count}
+    records = np.memmap(path, dtype, mode="r", offset=TELEMETRY_HEADER.size, shape=(capacity,))
+    if count <= capacity:
+        return header, records[:count]
+    head = count % capacity  # いちばん古いレコードの位置
+    return header, np.concatenate((records[head:], records[:head]))
+
+
+class Game:
+    """
+    描画から切り離したゲームの状態と，1フレーム分の処理を行うクラス
+    画面Surfaceやclock.tickを使わないので，ダミーのビデオドライバで実時間より速く動かせる
+    """
+    def __init__(self, seed: int | None = None, numpy_engine: bool = False, caps: dict[str, int] | None = None,
+                 rules: dict[str, int] | None = None, effects: bool = True):
+        """
+        引数1 seed：乱数の種（Noneのときはランダムに決める）
+        引数2 numpy_engine：爆弾とビームの移動をProjectileEngineでまとめて行うかどうか
+        引数3 caps：グループ名をキーとした同時に存在できる数の上限（DEFAULT_CAPSを上書きする）
+        引数4 rules：しきい値の名前をキーとしたゲームバランスの設定（DEFAULT_RULESを上書きする）
+        引数5 effects：爆発エフェクトを出すかどうか（描画しないバッチや強化学習ではFalseにすると速い）
+        """
+        self.rules = dict(DEFAULT_RULES, **(rules or {}))
+        self.bird = Bird(3, (900, 400))
+        self.hp = Hp(40, 800, 100, self.rules["hp_max"])
+        self.score = Score()
+        self.bombs = pg.sprite.Group()
+        self.beams = pg.sprite.Group()
+        self.exps = pg.sprite.Group()
+        self.emys = pg.sprite.Group()
+        self.Shields = pg.sprite.Group()
+        self.fires = pg.sprite.Group()
+        self.gravity = pg.sprite.Group()
+        self.grid = SpatialHash()  # ビーム，重力球，防御壁を登録する空間ハッシュ
+        self.projectiles = ProjectileEngine() if numpy_engine else None
+        self.effects = effects
+        self.particles = ParticleSystem() if effects and np is not None else None  # NumPyがなければExplosionで代用する
+        self.caps = dict(DEFAULT_CAPS, **(caps or {}))
+        self.profiler = FrameProfiler()  # 計測するときはmainなどで差し替える
+        self.interpolate = False  # 描画で補間するため，ステップ前の位置を記録するかどうか
+        self.prev_pos = {}  # スプライトをキーとした，直前のステップを始めたときの左上の座標
+        self.spawner = Scheduler()  # 敵機の出現と爆弾投下の予定（衝突判定の前に実行する）
+        self.timers = Scheduler()  # 寿命やリロード表示などの予定（ステップの最後に実行する）
+        self.reset(seed)
+
+    def reset(self, seed: int | None = None):
+        """
+        ゲームを最初の状態に戻す
+        スプライトのグループや画像は作り直さず，中身を空にして再利用する（削除したスプライトはプールに戻る）
+        引数 seed：乱数の種（Noneのときはランダムに決める）
+        """
+        self.seed = seed if seed is not None else random.randrange(2**32)
+        self.rng = random.Random(self.seed)  # 敵機，爆弾の乱数はすべてこれを使う
+        for group in (self.bombs, self.beams, self.exps, self.emys, self.Shields, self.fires, self.gravity):
+            for spr in group.sprites():
+                spr.kill()
+        self.bird.__init__(3, (900, 400))
+        self.hp.__init__(40, 800, 100, self.rules["hp_max"])
+        self.score.score = 0
+        self.tmr = 0
+        self.re = 0
+        self.count = 0
+        self.re_time = False
+        self.state = "playing"  # playing：プレイ中，clear：ゲームクリア，over：ゲームオーバー
+        self.cause = None  # ゲームオーバーの原因（hp，fire，enemy）
+        self.prev_pos = {}
+        if self.particles is not None:
+            self.particles.reset(self.seed)
+        self.spawner.clear()
+        self.timers.clear()
+        self.spawner.every(0, 200, self.spawn_enemy, order=-1)  # 200ステップに1回，敵機を出現させる（爆弾投下より先）
+        self.enemy_serial = 0  # 次に出現する敵機の番号（同じステップの爆弾投下は出現した順に行う）
+        self.hyper_timer = None  # ハイパーモードを終えるTimer
+        self.reload_timer = None  # リロード時間の表示を進めるTimer
+
+    def game_over(self, cause: str, num: int):
+        """
+        ゲームオーバーにする
+        引数1 cause：ゲームオーバーの原因
+        引数2 num：こうかとん画像ファイル名の番号
+        """
+        self.bird.change_img(num)
+        self.state = "over"
+        self.cause = cause
+
+    def room(self, name: str) -> int:
+        """
+        グループにあと何個スプライトを追加できるかを返す
+        引数 name：グループ名（emys，bombs，beams，exps）
+        戻り値：上限までの残り数
+        """
+        return max(self.caps[name]-len(getattr(self, name)), 0)
+
+    def add_beams(self, *beams: Beam):
+        """
+        ビームを上限まで追加する（エンジンを使うときはエンジンにも登録する）
+        """
+        beams = beams[:self.room("beams")]
+        self.beams.add(*beams)
+        for beam in beams:  # プールから再利用したビームの前世の位置から補間しない
+            self.prev_pos.pop(beam, None)
+        if self.projectiles is not None:
+            for beam in beams:
+                self.projectiles.add(beam)
+
+    def add_bomb(self, bomb: Bomb):
+        """
+        爆弾を追加する（エンジンを使うときはエンジンにも登録する）
+        """
+        if not self.room("bombs"):
+            return
+        self.bombs.add(bomb)
+        self.prev_pos.pop(bomb, None)
+        if self.projectiles is not None:
+            self.projectiles.add(bomb)
+
+    def add_exp(self, obj: "Bomb|Enemy", life: int):
+        """
+        爆発エフェクトを追加する（NumPyがなければ，上限に達していないときだけExplosionを追加する）
+        引数1 obj：爆発するBombまたは敵機
+        引数2 life：爆発時間
+        """
+        if not self.effects:
+            return
+        if self.particles is not None:
+            self.particles.burst(obj.rect.center, life)
+        elif self.room("exps"):
+            exp = spawn(Explosion, obj, life)
+            self.exps.add(exp)
+            exp.schedule(self.timers, self.tmr)
+
+    def add_timed(self, group: pg.sprite.AbstractGroup, spr: "Shield|Gravity"):
+        """
+        寿命のあるスプライトを追加し，spr.lifeステップ後に削除する
+        引数1 group：追加先のグループ
+        引数2 spr：防御壁または重力球
+        """
+        group.add(spr)
+        self.timers.at(self.tmr+spr.life, spr.kill)
+
+    def add_enemy(self, emy: Enemy):
+        """
+        敵機を追加する（停止状態になったら爆弾投下を予定する）
+        引数 emy：敵機
+        """
+        emy.serial = self.enemy_serial
+        self.enemy_serial += 1
+        emy.on_stop = self.start_bombing
+        self.emys.add(emy)
+        if emy.state == "stop":  # 最初から止まっている敵機は，今のステップから投下を始める
+            self.schedule_bombing(emy, self.tmr)
+
+    def spawn_enemy(self):
+        if self.room("emys"):
+            self.add_enemy(Enemy(self.rng, (self.rules["interval_min"], self.rules["interval_max"])))
+
+    def start_bombing(self, emy: Enemy):
+        """
+        敵機が停止状態に入ったとき（Enemy.update）に呼ばれ，次のステップからの爆弾投下を予定する
+        """
+        self.schedule_bombing(emy, self.tmr+1)
+
+    def schedule_bombing(self, emy: Enemy, start: int):
+        """
+        start以降，ステップ番号がemy.intervalで割り切れるステップごとに爆弾を投下する
+        """
+        emy.drop_timer = self.spawner.every(next_multiple(start, emy.interval), emy.interval,
+                                            self.drop_bomb, emy, order=emy.serial)
+
+    def drop_bomb(self, emy: Enemy):
+        if not emy.alive():  # 倒された敵機の予定は取り消す
+            emy.drop_timer.cancel()
+            return
+        if self.room("bombs"):
+            self.add_bomb(spawn(Bomb, emy, self.bird, self.rng))
+
+    def start_reload(self):
+        """
+        5発撃ったらリロードを始め，経過秒数の表示を1秒ごとに進める（5秒を過ぎたら表示しないので止める）
+        """
+        tmr = self.tmr
+        self.re = tmr/SIM_FPS#時間を記録
+        self.re_time = Reload(self.re-tmr//SIM_FPS, SIM_FPS)#Reloadクラスのインスタンス作成
+        if self.reload_timer is not None:
+            self.reload_timer.cancel()
+        self.reload_timer = self.timers.every(next_multiple(tmr, SIM_FPS), SIM_FPS, self.re_time.time_up, 1, count=6)
+
+    def start_hyper(self, life: int):
+        """
+        ハイパーモードにして，lifeステップ後に元に戻す（ハイパーモード中ならそこから延長する）
+        """
+        self.bird.change_state("hyper", life)
+        if self.hyper_timer is not None:
+            self.hyper_timer.cancel()
+        self.hyper_timer = self.timers.at(self.tmr+life, self.bird.change_state, "normal", -1)
+
+    def collide(self) -> dict[str, list[pg.sprite.Sprite]]:
+        """
+        すべての衝突を1回の走査でまとめて判定する
+        ビーム，重力球，防御壁を空間ハッシュに登録し，敵機と爆弾はそれぞれ1回だけ近くの相手と判定する
+        rectが重なった相手だけ，キャッシュしたMaskでピクセル単位に判定し直す
+        爆弾が複数の相手に触れているときは，ビーム，こうかとん，重力球，防御壁の順に優先する
+        ぶつかった敵機，爆弾，ビームはここで削除する
+        戻り値：衝突の種類をキーとした，ぶつかった敵機または爆弾のリストの辞書
+        """
+        hits = {"emy_beam": [], "emy_bird": [], "bomb_beam": [], "bomb_bird": [], "bomb_gravity": [], "bomb_shield": []}
+        # 斜め向きのこうかとんの画像はrectより大きく，rectの左上から描かれるので，描かれる範囲で判定する
+        bird_rect = self.bird.image.get_rect(topleft=self.bird.rect.topleft)
+        grid = self.grid
+        grid.clear()
+        for group in (self.beams, self.gravity, self.Shields):
+            for spr in group:
+                grid.insert(spr)
+
+        for emy in self.emys.sprites():
+            near = [spr for spr in grid.query(emy.rect)
+                    if spr in self.beams and emy.rect.colliderect(spr.rect) and collide_pixel(emy, spr)]
+            if near:
+                for beam in near:
+                    beam.kill()
+                emy.kill()
+                hits["emy_beam"].append(emy)
+            elif emy.rect.colliderect(bird_rect) and collide_pixel(emy, self.bird):
+                hits["emy_bird"].append(emy)
+
+        for bomb in self.bombs.sprites():
+            near = [spr for spr in grid.query(bomb.rect)
+                    if spr.alive() and bomb.rect.colliderect(spr.rect) and collide_pixel(bomb, spr)]
+            beams = [spr for spr in near if spr in self.beams]
+            if beams:
+                for beam in beams:
+                    beam.kill()
+                kind = "bomb_beam"
+            elif bomb.rect.colliderect(bird_rect) and collide_pixel(bomb, self.bird):
+                kind = "bomb_bird"
+            elif any(spr in self.gravity for spr in near):
+                kind = "bomb_gravity"
+            elif any(spr in self.Shields for spr in near):
+                kind = "bomb_shield"
+            else:
+                continue
+            bomb.kill()
+            hits[kind].append(bomb)
+        return hits
+
+    def step(self, inp: FrameInput):
+        """
+        入力に従ってゲームを1ステップ（SIM_DT秒）進める
+        引数 inp：このステップの入力
+        """
+        if self.state != "playing":
+            return
+        if self.interpolate:
+            self.prev_pos = {spr: spr.rect.topleft for group in (self.beams, self.bombs, self.emys) for spr in group}
+            self.prev_pos[self.bird] = self.bird.rect.topleft
+        bird, score, hp, tmr, rules = self.bird, self.score, self.hp, self.tmr, self.rules
+        shift_pressed = False
+        for ev_type, key in inp.events:
+            if ev_type == pg.KEYDOWN and key == pg.K_SPACE and (self.re ==0 or tmr/SIM_FPS>self.re+5) :#ビームを５回以上だした後に５秒たったら
+                self.add_beams(spawn(Beam, bird))
+                self.count += 1#出した数ビームの数
+                if self.count >= 5:#出したビームの数が５いじょうなら
+                    self.start_reload()#時間を記録してReloadクラスのインスタンス作成
+                    self.count = 0#出したビームの数を０にする
+                if inp.mods & pg.KMOD_LSHIFT :
+                    self.count += 5#出した数ビームの数
+                    if self.count >= 5:
+                        self.count = 0
+                        self.start_reload()
+                    shift_pressed = True
+            if ev_type == pg.KEYDOWN and key == pg.K_CAPSLOCK:
+                if score.score >= 10 and len(self.Shields) == 0:
+                    self.add_timed(self.Shields, Shield(bird,400))
+                    score.score -= 50
+
+            if ev_type == pg.KEYDOWN and key == pg.K_RSHIFT and score.score >= rules["hyper_score"]:
+                self.start_hyper(500)
+                score.score_up(-rules["hyper_score"])
+            if ev_type == pg.KEYDOWN and key == pg.K_LSHIFT:
+                bird.speed = 20
+            if ev_type == pg.KEYUP and key == pg.K_LSHIFT:
+                bird.speed = 10
+            if ev_type == pg.KEYDOWN and key == pg.K_TAB and score.score >= 50:
+                score.score_up(-50)
+                self.add_timed(self.gravity, Gravity(bird, 200, 500))
+
+        prof = self.profiler
+        prof.mark("events")
+
+        if score.score >= rules["fire_score"] and len(self.fires) == 0:
+            self.fires.add(fire(bird,400))
+
+        # 敵機の出現と，停止状態に入った敵機のintervalに応じた爆弾投下のうち，今のステップの分だけ行う
+        self.spawner.run(tmr)
+
+        prof.mark("spawn")
+        hits = self.collide()
+        for emy in hits["emy_beam"]:
+            self.add_exp(emy, 100)  # 爆発エフェクト
+            score.score_up(10)  # 10点アップ
+            bird.change_img(6)  # こうかとん喜びエフェクト
+
+        for bomb in hits["bomb_beam"]:
+            self.add_exp(bomb, 50)  # 爆発エフェクト
+            score.score_up(1)  # 1点アップ
+
+        for bomb in hits["bomb_bird"]:
+            if bird.state == "hyper":
+                self.add_exp(bomb, 50)  # 爆発エフェクト
+                score.score_up(1)  # 1点アップ
+
+            else:
+                self.add_exp(bomb, 50) #爆発エフェクト
+                hp.hp -= 1 #㏋　ー１
+                if hp.hp == 0: #HPがなくなったら
+                    self.game_over("hp", 8) # こうかとん悲しみエフェクト
+                    return
+
+        for bomb in hits["bomb_gravity"]:
+            self.add_exp(bomb, 50)
+
+        if len(pg.sprite.spritecollide(bird, self.fires, True)) != 0:#こうかとんが火（オレンジの四角）に触れたら負け
+            self.game_over("fire", 10) # 焼き鳥の画像
+            return
+
+        if hits["emy_bird"]: #こうかとんが敵に触れたら負け
+            for emy in hits["emy_bird"]:
+                emy.kill()
+            self.game_over("enemy", 8) # こうかとん悲しみエフェクト
+            return
+
+        for bomb in hits["bomb_shield"]:
+            self.add_exp(bomb, 50)  # 爆発エフェクト
+            score.score_up(1)
+        prof.mark("collide")
+
+        if shift_pressed: #左shiftおされたら
+            if inp.mods & pg.KMOD_LSHIFT:
+                num_beams = 5
+                neo_beam = NeoBeam(bird, num_beams)
+                self.add_beams(*neo_beam.gen_beams())
+
+        if score.score >= rules["clear_score"] : #scoreがクリアのスコア（300点）以上になると
+            self.state = "clear" #クリア後というのを示す
+            return
+
+        prof.mark("skills")
+
+        bird.update(inp.keys)
+        prof.mark("update_bird")
+        if self.projectiles is not None:
+            self.projectiles.step()  # 爆弾とビームをまとめて動かす
+        else:
+            self.beams.update()
+            self.bombs.update()
+        prof.mark("update_projectiles")
+        hp.update()
+        self.emys.update()
+        prof.mark("update_emys")
+        # 爆発・防御壁・重力球の寿命，ハイパーモードの終わり，リロード表示のうち，今のステップの分だけ行う
+        self.timers.run(tmr)
+        prof.mark("timers")
+        if self.particles is not None:
+            self.particles.step()
+            prof.mark("update_particles")
+        self.tmr += 1
+
+
+class Renderer:
+    """
+    Gameの状態を画面に描画するクラス
+    blit，blitsを持つので，スプライトのupdate/drawには画面Surfaceの代わりに渡せる
+    dirty=Trueのときは，前フレームと今フレームで描画した領域だけを背景で塗り直し，
+    その領域だけを画面に反映する
+    render_scale<1のときは，画面より小さいSurface（内部解像度）に縮めた画像で描画し，
+    フレームの最後に1回だけ画面の大きさに拡大する（座標はゲームのWIDTH×HEIGHTのまま渡せばよい）
+    """
+    def __init__(self, screen: pg.Surface, bg_img: pg.Surface, dirty: bool = False, render_scale: float = 1.0,
+                 scale_mode: str = "nearest"):
+        """
+        引数1 screen：画面Surface
+        引数2 bg_img：背景画像Surface
+        引数3 dirty：変化した領域だけを描き直すかどうか（内部解像度で描くときは使えない）
+        引数4 render_scale：内部解像度の画面に対する割合（1なら画面に直接描く）
+        引数5 scale_mode：画面への拡大のしかた（nearest：画面いっぱいに最近傍で拡大，
+                          integer：入る最大の整数倍に最近傍で拡大して中央に置く，
+                          smooth：画面いっぱいになめらかに拡大．見た目はよいが，毎フレーム画面全体を補間するので重い）
+        """
+        self.window = screen  # 実際の画面
+        self.scale = render_scale
+        self.scaled = weakref.WeakKeyDictionary()  # 元の画像をキーとした内部解像度に縮めた画像
+        if render_scale != 1.0:
+            size = max(1, round(WIDTH*render_scale)), max(1, round(HEIGHT*render_scale))
+            screen = to_display(pg.Surface(size))  # 内部解像度の描画先
+            if scale_mode == "integer":
+                k = max(1, min(self.window.get_width()//size[0], self.window.get_height()//size[1]))
+                view = pg.Rect(0, 0, size[0]*k, size[1]*k)
+                view.center = self.window.get_rect().center
+            else:
+                view = self.window.get_rect()
+            self.view = self.window.subsurface(view)  # 拡大した画像を書き込む画面の範囲
+            self.window.fill((0, 0, 0))  # 整数倍で余った周りは黒のまま
+            self.scale_mode = scale_mode
+            dirty = False  # 毎フレーム画面全体を拡大するので，変化した領域だけの反映はしない
+        self.screen = screen
+        self.base_bg = bg_img  # 火がついていないときの背景
+        self.bg_img = bg_img
+        self.fire_bg = None  # 焼野原を合成済みの背景
+        self.dirty = dirty
+        self.clear_img = load_img("text_gameclear.png")
+        self.finish = Finish()
+        self.conti = Continue()
+        self.font1 = get_font(50)
+        self.profiler = FrameProfiler()  # 計測するときはmainで差し替える
+        self.show_profile = False  # 計測結果を画面に重ねるかどうか
+        self.alpha_effects = True  # 重力球を半透明で描くかどうか（QualityGovernorが止める）
+        self.hud_hp = None  # --pipelineでSnapshotのHPバーを描くHp（描画のスレッドで持ち，バーの画像を使い回す）
+        self.opaque_imgs = weakref.WeakKeyDictionary()  # 元の画像をキーとした半透明をやめた画像
+        self.rects = []  # 今フレームに描画した領域
+        self.prev_rects = []  # 前フレームに描画した領域
+        self.full = True  # 今フレームは画面全体を描き直すかどうか
+
+    def begin(self):
+        """
+        フレームの描画を始める（前フレームの描画を背景で消す）
+        """
+        if not self.dirty or self.full:
+            self.screen.blit(self.fit(self.bg_img), [0, 0])
+        else:
+            for rect in self.prev_rects:
+                self.screen.blit(self.bg_img, rect, rect)
+        self.rects = []
+
+    def fill_bg(self):
+        """
+        画面全体を背景で塗り直し，今フレームは画面全体を反映する
+        """
+        self.screen.blit(self.fit(self.bg_img), [0, 0])
+        self.full = True
+
+    def fit(self, img: pg.Surface) -> pg.Surface:
+        """
+        画像を内部解像度に縮めて返す（画像ごとに一度だけ縮め，元の画像が消えるまで再利用する）
+        引数 img：元の画像Surface
+        戻り値：縮めた画像Surface（内部解像度で描かないときはimgそのまま）
+        """
+        if self.scale == 1.0:
+            return img
+        scaled = self.scaled.get(img)
+        if scaled is None:
+            size = max(1, round(img.get_width()*self.scale)), max(1, round(img.get_height()*self.scale))
+            if img.get_colorkey() is None and img.get_bitsize() >= 24:
+                scaled = pg.transform.smoothscale(img, size)
+            else:  # カラーキーの色が周りと混ざらないよう最近傍で縮める（カラーキーと透明度は引き継がれる）
+                scaled = pg.transform.scale(img, size)
+            self.scaled[img] = scaled
+        return scaled
+
+    def opaque(self, img: pg.Surface) -> pg.Surface:
+        """
+        Surface全体の透明度をやめた画像を返す（画像ごとに一度だけ作る）
+        """
+        opaque = self.opaque_imgs.get(img)
+        if opaque is None:
+            opaque = self.opaque_imgs[img] = img.copy()
+            opaque.set_alpha(None)
+        return opaque
+
+    def to_canvas(self, dest):
+        """
+        ゲームの座標（位置のタプルかRect）を内部解像度の座標に変換する
+        """
+        if isinstance(dest, pg.Rect):
+            dest = dest.topleft
+        return int(dest[0]*self.scale), int(dest[1]*self.scale)
+
+    def blit(self, img: pg.Surface, dest, area=None, special_flags: int = 0) -> pg.Rect:
+        """
+        画面にSurfaceを転送し，転送した領域を記録する
+        """
+        if self.scale != 1.0:
+            img, dest = self.fit(img), self.to_canvas(dest)
+            if area is not None:
+                area = pg.Rect(self.to_canvas(area), self.to_canvas(pg.Rect(area).size))
+        rect = self.screen.blit(img, dest, area, special_flags)
+        self.rects.append(rect)
+        return rect
+
+    def blits(self, blit_sequence, doreturn: bool = True, fitted: bool = False) -> list[pg.Rect]:
+        """
+        画面に複数のSurfaceをまとめて転送し，転送した領域を記録する（Group.drawから呼ばれる）
+        fitted=Trueのときは，画像も座標も内部解像度に変換済みとしてそのまま転送する
+        """
+        if self.scale != 1.0 and not fitted:
+            fit, to_canvas = self.fit, self.to_canvas
+            blit_sequence = [(fit(img), to_canvas(dest), *rest) for img, dest, *rest in blit_sequence]
+        rects = self.screen.blits(blit_sequence, doreturn=True)
+        self.rects.extend(rects)
+        return rects
+
+    def present(self):
+        """
+        今フレームの描画を画面に反映する（内部解像度で描いたときは，ここで1回だけ画面の大きさに拡大する）
+        """
+        if self.scale != 1.0:
+            if self.scale_mode == "smooth":
+                pg.transform.smoothscale(self.screen, self.view.get_size(), self.view)
+            else:
+                pg.transform.scale(self.screen, self.view.get_size(), self.view)
+        if not self.dirty or self.full:
+            pg.display.update()
+            self.full = False
+        else:
+            pg.display.update(self.prev_rects + self.rects)
+        self.prev_rects = self.rects
+
+    def set_fire(self, fires: pg.sprite.Group):
+        """
+        焼野原があれば，背景に一度だけ合成しておいた背景に切り替える
+        （焼野原は動かないので，毎フレーム半透明で重ねる代わりに背景として描く）
+        引数 fires：焼野原のグループ
+        """
+        if fires and self.fire_bg is None:
+            self.fire_bg = self.base_bg.copy()
+            for spr in fires:
+                self.fire_bg.blit(spr.image, spr.rect)
+        bg_img = self.fire_bg if fires else self.base_bg
+        if bg_img is not self.bg_img:
+            self.bg_img = bg_img
+            self.full = True  # 背景が変わったので画面全体を描き直す
+
+    def draw_moving(self, group: pg.sprite.AbstractGroup, game: "Game|Snapshot", alpha: float):
+        """
+        動くスプライトを，直前のステップの位置と今の位置の間で補間した位置に描画する
+        引数1 group：描画するグループ（またはSpriteStateのタプル）
+        引数2 game：直前の位置を記録したGameまたはSnapshot
+        引数3 alpha：補間の割合（0なら直前のステップの位置，1なら今の位置）
+        """
+        if alpha >= 1.0 or not game.prev_pos:
+            self.blits([(spr.image, spr.rect) for spr in group])
+            return
+        prev_pos = game.prev_pos
+        seq = []
+        for spr in group:
+            x, y = spr.rect.topleft
+            px, py = prev_pos.get(spr, (x, y))
+            seq.append((spr.image, (round(px+(x-px)*alpha), round(py+(y-py)*alpha))))
+        self.blits(seq)
+
+    def draw_hp(self, game: "Game|Snapshot"):
+        """
+        HPバーを描画する（Snapshotのときは，hud_hpに値を写して描く．バーは値が変わったときだけ描き直される）
+        """
+        if isinstance(game, Snapshot):
+            self.hud_hp.show(game.hp_values)
+            self.hud_hp.draw(self)
+        else:
+            game.hp.draw(self)
+
+    def draw(self, game: "Game|Snapshot", alpha: float = 1.0):
+        """
+        Gameの状態を1フレーム分描画して画面に反映する
+        引数1 game：描画するGame（--pipelineのときはGameのSnapshot）
+        引数2 alpha：動くスプライトの補間の割合（1なら補間しない）
+        """
+        prof = self.profiler
+        self.set_fire(game.fires)
+        self.begin()
+        prof.mark("draw_bg")
+        if game.state == "clear":
+            self.fill_bg()
+            self.blit(self.clear_img, [300, 200]) # ゲームクリア
+            game.score.update(self) #スコア表示
+            self.finish.update(self) #終わらせるボタンを表示
+            self.conti.update(self) #続けるボタンを表示
+        elif game.state == "over":
+            self.blit(game.bird.image, game.bird.rect)
+            game.score.update(self)
+            if game.cause == "fire":
+                text1 = self.font1.render("grilled chicken", True, (255,64,64))
+                self.blit(text1, (500,500))#火にあたって負けた場合のメッセージ
+        else:
+            if self.alpha_effects:
+                self.blits([(spr.image, spr.rect) for spr in game.gravity])
+            else:
+                self.blits([(self.opaque(spr.image), spr.rect) for spr in game.gravity])
+            self.draw_moving([game.bird], game, alpha)
+            prof.mark("draw_bird")
+            self.draw_moving(game.beams, game, alpha)
+            prof.mark("draw_beams")
+            self.draw_hp(game)
+            self.draw_moving(game.emys, game, alpha)
+            prof.mark("draw_emys")
+            self.draw_moving(game.bombs, game, alpha)
+            prof.mark("draw_bombs")
+            self.blits([(spr.image, spr.rect) for spr in game.exps])
+            if game.particles is not None:
+                game.particles.draw(self, alpha)
+            prof.mark("draw_exps")
+            self.blits([(spr.image, spr.rect) for spr in game.Shields]) #防御壁の描画（焼野原は背景に合成済み）
+            if game.re_time and game.re_time.start <= 5:
+                game.re_time.update(self)
+            game.score.update(self)
+            prof.mark("draw_hud")
+        if self.show_profile:
+            overlay = prof.get_overlay()
+            self.blit(overlay, (WIDTH-overlay.get_width()-10, 10))
+        self.present()
+        prof.mark("present")
+
+
+class SpriteState:
+    """
+    スプライトの描画に必要な画像と位置だけを写し取ったもの（作ったあとは変更しない）
+    """
+    __slots__ = ("image", "rect")
+
+    def __init__(self, spr: pg.sprite.Sprite):
+        self.image = spr.image  # 画像は作り直すことはあっても書き換えないので，写さずに共有する
+        self.rect = spr.rect.copy()
+
+
+class Snapshot:
+    """
+    --pipelineで，シミュレーションのスレッドがステップを進めるたびに作る，Gameの描画に必要な状態の写し
+    Rendererが読む属性はGameと同じ名前で持つので，Renderer.drawにGameの代わりに渡せる
+    作ったあとは変更しないので，シミュレーションのスレッドが次のステップを進めている間も描画のスレッドから読める
+    """
+    def __init__(self, game: Game, time: float, input_stamp: float | None = None):
+        """
+        引数1 game：写し取るGame
+        引数2 time：最後のステップを進めたことになっている時刻（time.perf_counterの値．描画の補間に使う）
+        引数3 input_stamp：このSnapshotまでのステップに渡した入力のうち，最初に読んだ時刻（入力遅延の計測に使う）
+        """
+        self.time = time
+        self.input_stamp = input_stamp
+        self.tmr = game.tmr
+        self.state = game.state
+        self.cause = game.cause
+        self.prev_pos = {}  # SpriteStateをキーとした，直前のステップを始めたときの左上の座標
+        self.bird = self.capture([game.bird], game.prev_pos)[0]
+        self.beams = self.capture(game.beams, game.prev_pos)
+        self.emys = self.capture(game.emys, game.prev_pos)
+        self.bombs = self.capture(game.bombs, game.prev_pos)
+        self.exps = self.capture(game.exps)
+        self.gravity = self.capture(game.gravity)
+        self.Shields = self.capture(game.Shields)
+        self.fires = self.capture(game.fires)
+        self.hp_values = game.hp.values()  # HPバーは描画のスレッドのHp（Renderer.hud_hp）がこの値で描く
+        self.score = copy.copy(game.score)  # 表示用のHudTextは描画のスレッドだけが使う
+        self.re_time = copy.copy(game.re_time)
+        self.particles = game.particles.snapshot() if game.particles is not None else None
+
+    def capture(self, group, prev_pos: dict | None = None) -> tuple[SpriteState, ...]:
+        """
+        グループのスプライトをSpriteStateのタプルに写し取る
+        引数1 group：スプライトのグループ（またはリスト）
+        引数2 prev_pos：Game.prev_pos（動くスプライトのとき．直前の位置もSpriteStateをキーにして写す）
+        戻り値：SpriteStateのタプル
+        """
+        states = tuple(SpriteState(spr) for spr in group)
+        if prev_pos:
+            for spr, state in zip(group, states):
+                if spr in prev_pos:
+                    self.prev_pos[state] = prev_pos[spr]
+        return states
+
+
+class SnapshotBuffer:
+    """
+    シミュレーションのスレッドが書き，描画のスレッドが読むSnapshotのダブルバッファ
+    書く側は裏の面に置いてから表と裏を入れ替えるので，読む側はいつでも書き終わった最新のSnapshotを受け取る
+    """
+    def __init__(self):
+        self.slots = [None, None]
+        self.front = 0  # 読む側に見せる面の番号
+        self.serial = 0  # 入れ替えた回数
+        self.lock = threading.Lock()
+
+    def publish(self, snap: Snapshot):
+        with self.lock:
+            back = 1-self.front
+            self.slots[back] = snap
+            self.front = back
+            self.serial += 1
+
+    def latest(self) -> Snapshot | None:
+        with self.lock:
+            return self.slots[self.front]
+
+
+class SimulationThread(threading.Thread):
+    """
+    --pipelineで，固定時間のステップを別スレッドで進め，進めるたびにSnapshotをバッファに置くスレッド
+    メインスレッドはset_inputで入力を渡し，bufferの最新のSnapshotを描画する
+    ステップに渡す入力と順番はmainと同じなので，同じ入力ならゲームの進み方は変わらない
+    """
+    def __init__(self, game: Game, replay=None, recorder: InputRecorder | None = None,
+                 telemetry: TelemetryWriter | None = None):
+        """
+        引数1 game：進めるGame（スレッドが動いている間はメインスレッドから触らない）
+        引数2 replay：記録した入力のイテレータ（Noneのときはset_inputで渡された入力を使う）
+        引数3 recorder：入力を記録するInputRecorder
+        引数4 telemetry：ステップごとに記録するTelemetryWriter
+        """
+        super().__init__(daemon=True)
+        self.game = game
+        self.replay = replay
+        self.recorder = recorder
+        self.telemetry = telemetry
+        self.buffer = SnapshotBuffer()
+        self.lock = threading.Lock()  # 入力の受け渡し用
+        self.keys = {k: False for k in Bird.delta}  # 押下中のキー
+        self.mods = 0
+        self.pending = []  # まだステップに渡していないイベント
+        self.stamp = None  # まだステップに渡していない入力のうち，最初に読んだ時刻
+        self.frame_ms = 0.0  # 描画のスレッドの直前のフレーム時間（テレメトリに記録する）
+        self.stopping = threading.Event()
+        self.finished = False  # ゲームオーバー画面を表示し終えたか，記録した入力を使い切ったか
+        self.error = None  # スレッドで起きた例外
+        self.buffer.publish(Snapshot(game, time.perf_counter()))
+
+    def set_input(self, inp: FrameInput, frame_ms: float):
+        """
+        メインスレッドで読んだ入力を渡す（イベントは次のステップにまとめて渡す）
+        """
+        with self.lock:
+            self.keys, self.mods = inp.keys, inp.mods
+            self.pending.extend(inp.events)
+            if self.stamp is None:
+                self.stamp = inp.stamp
+            self.frame_ms = frame_ms
+
+    def take_input(self) -> FrameInput:
+        with self.lock:
+            step_inp = FrameInput(self.keys, self.pending, self.mods, stamp=self.stamp)
+            self.pending, self.stamp = [], None
+        return step_inp
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+    def run(self):
+        try:
+            self.simulate()
+        except BaseException as e:  # メインスレッドで投げ直す
+            self.error = e
+        finally:
+            self.finished = True
+
+    def simulate(self):
+        """
+        mainのループと同じく，経過時間の分だけ固定時間のステップを進める
+        """
+        game = self.game
+        over_frames = 0  # ゲームオーバー画面を表示したステップ数
+        acc = 0.0  # まだシミュレーションしていない経過時間（秒）
+        last = time.perf_counter()
+        while not self.stopping.is_set():
+            now = time.perf_counter()
+            acc += now-last
+            last = now
+            steps = 0
+            input_stamp = None
+            while acc >= SIM_DT and steps < MAX_SIM_STEPS:
+                if self.replay is not None:
+                    step_inp = next(self.replay, None)
+                    if step_inp is None:  # 記録した入力を使い切った
+                        return
+                else:
+                    step_inp = self.take_input()
+                    if input_stamp is None:
+                        input_stamp = step_inp.stamp
+                playing = game.state == "playing"  # ゲームオーバー・クリアの画面ではステップが進まないので記録しない
+                if self.recorder is not None and playing:
+                    self.recorder.write(step_inp)
+                game.step(step_inp)
+                if self.telemetry is not None and playing:
+                    self.telemetry.write(game, self.frame_ms)
+                acc -= SIM_DT
+                steps += 1
+                if game.state == "over":
+                    over_frames += 1
+            if steps == MAX_SIM_STEPS:
+                acc = min(acc, SIM_DT)
+            if steps:
+                self.buffer.publish(Snapshot(game, now-acc, input_stamp))
+            if over_frames >= GAME_OVER_FRAMES:
+                return
+            self.stopping.wait(SIM_DT-acc)  # 次のステップの時刻まで待つ
+
+
+def run_pipelined(args: argparse.Namespace, game: Game, renderer: Renderer, governor: QualityGovernor,
+                  replay=None, recorder: InputRecorder | None = None, telemetry: TelemetryWriter | None = None,
+                  latency: LatencyMeter | None = None, on_first_frame=None):
+    """
+    --pipelineのメインループ
+    ステップはSimulationThreadで進め，メインスレッドは入力を読んで渡し，最新のSnapshotを補間して描画する
+    （pygameのblitや画面の反映はGILを手放すので，描画中に次のステップを進められる）
+    引数1 args：起動オプション
+    引数2 game：進めるGame
+    引数3 renderer：描画に使うRenderer
+    引数4 governor：画質レベルを決めるQualityGovernor
+    引数5 replay：記録した入力のイテレータ
+    引数6 recorder：入力を記録するInputRecorder
+    引数7 telemetry：ステップごとに記録するTelemetryWriter
+    引数8 latency：入力遅延を記録するLatencyMeter（新しいSnapshotを初めて描いたときに記録する）
+    引数9 on_first_frame：最初のフレームを描画したときに呼ぶ関数
+    """
+    profiler = renderer.profiler
+    game.profiler = FrameProfiler()  # 計測の記録は描画のスレッドだけが行う
+    # シミュレーションのスレッドではフォントを使わないよう，リロード表示のラベルはここで描いておく
+    get_digit_atlas(Reload.size, Reload.color).label(Reload.label)
+    renderer.hud_hp = Hp(game.hp.x, game.hp.y, game.hp.width, game.hp.max)
+    clock = pg.time.Clock()
+    tick = clock.tick_busy_loop if args.busy_wait else clock.tick
+    sim = SimulationThread(game, replay, recorder, telemetry)
+    sim.start()
+    drawn = None  # 前のフレームに描いたSnapshot
+    last = time.perf_counter()
+    try:
+        while True:
+            profiler.begin_frame()
+            now = time.perf_counter()
+            frame_ms = (now-last)*1000
+            last = now
+            inp = read_input()
+            profiler.mark("input")
+            if inp.quit:
+                return 0
+            if inp.pressed(pg.K_RETURN): #エンターキーを押したときにプログラムを終了
+                pg.quit()
+                sys.exit()
+            if sim.finished:
+                if sim.error is not None:
+                    raise sim.error
+                return 0
+            snap = sim.buffer.latest()
+            if snap.state == "clear" and inp.pressed(pg.K_SPACE): #クリア後スペースを押すともう一度プレイできる
+                sim.stop()  # クリア後はステップが進まないので，止めてからメインスレッドでやり直す
+                if recorder is not None:  # 記録は最初のゲームだけ
+                    recorder.close()
+                    recorder = None
+                game.reset(args.seed)
+                renderer.full = True
+                sim = SimulationThread(game, replay, None, telemetry)
+                sim.start()
+                continue
+            sim.set_input(inp, frame_ms)
+            alpha = min((now-snap.time)/SIM_DT, 1.0)
+            renderer.draw(snap, alpha)
+            if latency is not None and snap is not drawn and snap.input_stamp is not None:
+                latency.record(snap.input_stamp, time.perf_counter()+(1.0-alpha)*SIM_DT)
+            drawn = snap
+            if governor.update((time.perf_counter()-now)*1000):
+                governor.apply(game, renderer)  # 見た目だけの設定なので，スレッドが動いたまま変えてよい
+                print(governor.describe())
+            if on_first_frame is not None:
+                on_first_frame()
+                on_first_frame = None
+            tick(args.fps)
+            profiler.mark("wait")
+            profiler.end_frame()
+    finally:
+        sim.stop()
+
+
+def run_headless(frames: int | None, seed: int | None = None, numpy_engine: bool = False,
+                 caps: dict[str, int] | None = None, profiler: FrameProfiler | None = None,
+                 inputs: list[FrameInput] | None = None) -> Game:
+    """
+    描画もclock.tickも行わずに，できるだけ速くゲームを進める（負荷試験・リプレイ用）
+    引数1 frames：進めるフレーム数（Noneのときはinputsを使い切るまで）
+    引数2 seed：乱数の種
+    引数3 numpy_engine：ProjectileEngineを使うかどうか
+    引数4 caps：グループごとの上限
+    引数5 profiler：計測に使うFrameProfiler
+    引数6 inputs：フレームごとの入力（Noneのときは乱数で作る）
+    戻り値：進めたGame
+    """
+    prebake_imgs()
+    game = Game(seed, numpy_engine, caps)
+    if profiler is not None:
+        game.profiler = profiler
+    if inputs is None:
+        input_rng = random.Random(game.seed)
+        inputs = (random_input(input_rng) for _ in range(frames))
+    elif frames is not None:
+        inputs = inputs[:frames]
+    for inp in inputs:
+        if game.state != "playing":
+            break
+        game.profiler.begin_frame()
+        game.step(inp)
+        game.profiler.end_frame()
+    return game
+
+
+def print_report(game: Game, elapsed: float, profiler: FrameProfiler):
+    """
+    run_headlessの結果と計測結果を表示する
+    引数1 game：進めたGame
+    引数2 elapsed：かかった時間（秒）
+    引数3 profiler：計測に使ったFrameProfiler
+    """
+    print(f"seed={game.seed} frames={game.tmr} state={game.state} score={game.score.score} "
+          f"hp={game.hp.hp} fps={game.tmr/elapsed:.1f}")
+    for name, (p50, p95, p99) in ((n, profiler.percentiles(n)) for n in profiler.stages):
+        print(f"{name:>20} p50 {p50:7.3f} p95 {p95:7.3f} p99 {p99:7.3f} ms")
+
+
+def main(args: argparse.Namespace | None = None):
+    """
+    ゲームのメインループ
+    引数 args：parse_argsで解析した起動オプション（Noneのときはすべて既定値）
+    """
+    if args is None:
+        args = parse_args([])
+    start = time.perf_counter()
+    pg.display.set_caption("逆襲！エイリアン")
+    screen = pg.display.set_mode((WIDTH, HEIGHT))
+    normalize_assets()
+    loader = AssetLoader(None if args.no_bundle else fig_path(BUNDLE_NAME))  # 画像の読み込み・回転は別スレッドで行い，その間ロード画面を出す
+    loader.start()
+    if not show_loading(screen, loader):
+        return 0
+    loaded = time.perf_counter()
+    renderer = Renderer(screen, load_img("pg_bg.jpg"), args.dirty, args.render_scale, args.scale_mode)
+    replay = None
+    if args.replay:  # 記録した入力を実時間で再生する
+        seed, caps, inputs = read_replay(args.replay)
+        game = Game(seed, args.numpy, caps)
+        replay = iter(inputs)
+    else:
+        game = Game(args.seed, args.numpy, args.caps)
+    recorder = InputRecorder(args.record, game.seed, game.caps) if args.record else None
+    telemetry = TelemetryWriter(args.telemetry, game.seed, args.telemetry_steps) if args.telemetry else None
+    profiler = FrameProfiler(args.profile or args.profile_overlay or bool(args.profile_out))
+    game.profiler = renderer.profiler = profiler
+    renderer.show_profile = args.profile_overlay
+    governor = QualityGovernor(fixed=None if args.quality == "auto" else int(args.quality))
+    governor.apply(game, renderer)
+    game.interpolate = True  # 描画とステップの時刻はずれるので，動くスプライトは補間して描く
+    clock = pg.time.Clock()
+    tick = clock.tick_busy_loop if args.busy_wait else clock.tick
+    latency = LatencyMeter()
+    over_frames = 0  # ゲームオーバー画面を表示したステップ数
+    acc = 0.0  # まだシミュレーションしていない経過時間（秒）
+    pending = []  # まだステップに渡していないイベント
+    input_stamp = None  # まだステップに渡していない入力のうち，最初に読んだ時刻
+    first_frame = True
+
+    def report_startup():
+        print(f"起動時間：読み込み {loaded-start:.2f}秒{'（画像バンドル使用）' if loader.used_bundle else ''}，"
+              f"最初のフレームまで {time.perf_counter()-start:.2f}秒")
+
+    last = time.perf_counter()
+    try:
+        if args.pipeline:  # ステップは別スレッドで進め，このスレッドは描画する
+            return run_pipelined(args, game, renderer, governor, replay, recorder, telemetry, latency, report_startup)
+        while True:
+            if args.low_latency:  # フレームの最後ではなく，ここで次のステップの時刻まで待ってから入力を読む
+                wait_until(last+SIM_DT-acc, args.busy_wait)
+            profiler.begin_frame()
+            now = time.perf_counter()
+            frame_ms = (now-last)*1000  # 前のフレームからの時間（テレメトリに記録する）
+            acc += now-last
+            last = now
+            inp = read_input()
+            profiler.mark("input")
+            if inp.quit:
+                return 0
+            if inp.pressed(pg.K_RETURN): #エンターキーを押したときにプログラムを終了
+                pg.quit()
+                sys.exit()
+            if game.state == "clear" and inp.pressed(pg.K_SPACE): #クリア後スペースを押すともう一度プレイできる
+                if recorder is not None:  # 記録は最初のゲームだけ
+                    recorder.close()
+                    recorder = None
+                game.reset(args.seed)  # 画像やグループは再利用して最初からやり直す
+                renderer.full = True
+                acc, pending, input_stamp = 0.0, [], None
+                continue
+            pending.extend(inp.events)
+            if input_stamp is None:
+                input_stamp = inp.stamp
+            # 固定時間のステップを経過時間の分だけ進める（遅れたときは描画を飛ばしてステップを進める）
+            steps = 0
+            while acc >= SIM_DT and steps < MAX_SIM_STEPS:
+                if replay is not None:
+                    step_inp = next(replay, None)
+                    if step_inp is None:  # 記録した入力を使い切った
+                        return 0
+                else:  # イベントは最初のステップにだけ渡し，押しているキーはどのステップにも渡す
+                    step_inp = FrameInput(inp.keys, pending, inp.mods)
+                    pending = []
+                playing = game.state == "playing"  # ゲームオーバー・クリアの画面ではステップが進まないので記録しない
+                if recorder is not None and playing:
+                    recorder.write(step_inp)
+                game.step(step_inp)
+                if telemetry is not None and playing:
+                    telemetry.write(game, frame_ms)
+                acc -= SIM_DT
+                steps += 1
+                if game.state == "over":  # ゲームオーバー画面を2秒表示したら終わる
+                    over_frames += 1
+            if steps == MAX_SIM_STEPS:  # 追いつけないほど遅れたら，残りの遅れは切り捨てる
+                acc = min(acc, SIM_DT)
+            if over_frames >= GAME_OVER_FRAMES:
+                return
+            # 低遅延モードでは，進めたばかりのステップを補間せずに描いてすぐに画面に反映する
+            alpha = 1.0 if args.low_latency else min(acc/SIM_DT, 1.0)
+            renderer.draw(game, alpha)
+            if steps and replay is None:  # 補間で直前のステップの側に戻して描いた分も遅れとして数える
+                latency.record(input_stamp, time.perf_counter()+(1.0-alpha)*SIM_DT)
+                input_stamp = None
+            if governor.update((time.perf_counter()-now)*1000):  # 処理が重ければ見た目を軽くし，余裕があれば戻す
+                governor.apply(game, renderer)
+                print(governor.describe())
+            if first_frame:
+                report_startup()
+                first_frame = False
+            if not args.low_latency:
+                tick(args.fps)
+            profiler.mark("wait")
+            profiler.end_frame()
+    finally:
+        if recorder is not None:
+            recorder.close()
+        if telemetry is not None:
+            telemetry.close()
+        if args.low_latency or args.latency_out:
+            print(latency.report())
+        if args.latency_out:
+            latency.dump(args.latency_out)
+        if args.profile:
+            print(profiler.report())
+        if args.profile_out:
+            profiler.dump(args.profile_out)
+
+
+def parse_args(args: list[str] | None = None) -> argparse.Namespace:
+    """
+    コマンドライン引数を解析する
+    引数 args：引数のリスト（Noneのときはsys.argv）
+    戻り値：解析結果
+    """
+    parser = argparse.ArgumentParser(description="逆襲！エイリアン")
+    parser.add_argument("--dirty", action="store_true", help="変化した領域だけを描き直して画面に反映する")
+    parser.add_argument("--seed", type=int, default=None, help="敵機・爆弾の乱数の種")
+    parser.add_argument("--fps", type=int, default=SIM_FPS,
+                        help=f"描画の最大fps（0で制限なし）．ゲームの進み方は常に{SIM_FPS}ステップ/秒で，描画との間は補間する")
+    parser.add_argument("--render-scale", type=float, default=1.0, metavar="SCALE",
+                        help="内部解像度の画面に対する割合（0.5なら800×450で描いて画面の大きさに拡大する．--dirtyは無効になる）")
+    parser.add_argument("--scale-mode", choices=["nearest", "integer", "smooth"], default="nearest",
+                        help="内部解像度から画面への拡大のしかた（nearest：画面いっぱいに最近傍で，integer：整数倍で中央に，"
+                             "smooth：画面いっぱいになめらかに．smoothは見た目がよいが重い）")
+    parser.add_argument("--quality", choices=["auto", *map(str, range(len(QUALITY_LEVELS)))], default="auto",
+                        help="画質レベル（auto：処理が重いときは自動で見た目を軽くする，数字：そのレベルに固定する．0が最高画質）")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="ステップを別スレッドで進め，描画と重ねる（マルチコアで速くなる．ゲームの進み方は変わらない）")
+    parser.add_argument("--low-latency", action="store_true",
+                        help="フレームの最初に次のステップの時刻まで待ち，入力を読んですぐにステップを進め，補間せずに描いて画面に反映する"
+                             f"（描画は{SIM_FPS}fpsになり，--fpsは使わない）．終了時に入力から画面反映までの時間を表示する")
+    parser.add_argument("--busy-wait", action="store_true",
+                        help="フレームの間隔を空回りで待って正確にする（CPUを1つ使い続ける）")
+    parser.add_argument("--latency-out", default=None, metavar="PATH",
+                        help="フレームごとの入力から画面反映までの時間をCSVに書き出す（終了時に表示もする）")
+    parser.add_argument("--headless", type=int, default=0, metavar="FRAMES",
+                        help="画面を出さずに指定フレーム数だけ実時間より速く動かす")
+    parser.add_argument("--numpy", action="store_true", help="爆弾とビームの移動をNumPyでまとめて行う")
+    parser.add_argument("--cap", action="append", default=[], metavar="GROUP=N",
+                        help=f"グループごとの同時に存在できる数の上限（GROUPは{', '.join(DEFAULT_CAPS)}）")
+    parser.add_argument("--profile", action="store_true", help="1フレームの処理を段階ごとに計測する")
+    parser.add_argument("--profile-overlay", action="store_true", help="計測結果（p50/p95/p99）を画面に重ねて表示する")
+    parser.add_argument("--profile-out", default=None, metavar="PATH",
+                        help="終了時にフレームごとの計測結果を書き出す（.csvならCSV，それ以外はJSON）")
+    parser.add_argument("--record", default=None, metavar="PATH", help="乱数の種とフレームごとの入力をファイルに記録する")
+    parser.add_argument("--replay", default=None, metavar="PATH", help="記録した入力を再生する（乱数の種と上限も記録から使う）")
+    parser.add_argument("--telemetry", default=None, metavar="PATH",
+                        help="ステップごとのHP，スコア，リロード，爆弾・ビーム・敵機の数と位置，フレーム時間をバイナリで記録する")
+    parser.add_argument("--telemetry-steps", type=int, default=SIM_FPS*3600, metavar="N",
+                        help="--telemetryで記録するステップ数（超えたら古いものから上書きする．既定値は1時間分）")
+    parser.add_argument("--fast", action="store_true", help="--replayのとき，画面を出さずにできるだけ速く再生する")
+    parser.add_argument("--build-bundle", action="store_true",
+                        help=f"読み込み・拡大・回転済みの画像をfig/{BUNDLE_NAME}にまとめて終了する")
+    parser.add_argument("--no-bundle", action="store_true", help=f"fig/{BUNDLE_NAME}があっても使わない")
+    parsed = parser.parse_args(args)
+    if parsed.fast and not parsed.replay:
+        parser.error("--fast は --replay と一緒に指定してください")
+    parsed.caps = {}
+    for item in parsed.cap:
+        name, _, num = item.partition("=")
+        if name not in DEFAULT_CAPS or not num.isdigit():
+            parser.error(f"--cap の指定が正しくありません：{item}")
+        parsed.caps[name] = int(num)
+    if parsed.low_latency and parsed.pipeline:
+        parser.error("--low-latency と --pipeline は一緒に指定できません")
+    if parsed.telemetry_steps <= 0:
+        parser.error("--telemetry-steps には1以上を指定してください")
+    if parsed.fps < 0:
+        parser.error("--fps には0以上を指定してください")
+    if not 0 < parsed.render_scale <= 1:
+        parser.error("--render-scale には0より大きく1以下の値を指定してください")
+    if parsed.numpy and np is None:
+        parser.error("--numpy にはNumPyが必要です")
+    return parsed
 
-        gravity.update()#key_lst)これを有効化すると、球がついてくる。
-        gravity.draw(screen)
-        if shift_pressed: #左shiftおされたら
-            if pg.key.get_mods() & pg.KMOD_LSHIFT:
-                num_beams = 5
-                neo_beam = NeoBeam(bird, num_beams)
-                beams.add(*neo_beam.gen_beams())
-
-        if score.score >= 300 : #scoreが300点以上になると
-            screen.blit(bg_img, [0, 0])
-            screen.blit(clear_img, [300, 200]) # ゲームクリア
-            i = 1 #クリア後というのを示す
-            score.update(screen) #スコア表示
-            finish.update(screen) #終わらせるボタンを表示
-            conti.update(screen) #続けるボタンを表示
-            pg.display.update()
-        
-        if i == 0: #クリアしていない時に実行するもの
-            bird.update(key_lst, screen)
-            beams.update()
-            beams.draw(screen)
-            hp.update()
-            hp.draw(screen)
-            emys.update()
-            emys.draw(screen)
-            bombs.update()
-            bombs.draw(screen)
-            exps.update()
-            exps.draw(screen)
-            Shields.update() #防御壁の更新
-            Shields.draw(screen) #防御壁の描画
-            fires.update()#焼野原の更新
-            fires.draw(screen) #焼野原の描画
-            if re_time:
-                if tmr % 50 == 0:
-                    re_time.time_up(1)
-                if re_time.start <= 5:
-                    re_time.update(screen)
-
-            score.update(screen)
-            pg.display.update()
-            tmr += 1
-            clock.tick(50)
-        else:
-            if event.type == pg.KEYDOWN and event.key == pg.K_RETURN: #エンターキーを押したときにプログラムを終了
-                pg.quit()
-                sys.exit()
 
 if __name__ == "__main__":
+    args = parse_args()
+    if args.build_bundle:  # ダミーの画面の形式に変換した画像を書き出す
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        pg.init()
+        pg.display.set_mode((1, 1))
+        path = fig_path(BUNDLE_NAME)
+        size = build_bundle(path)
+        print(f"{path}：{size/2**20:.1f}MB")
+        pg.quit()
+        sys.exit()
+    if args.headless or args.fast:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        pg.init()
+        start = time.perf_counter()
+        profiler = FrameProfiler(args.profile or bool(args.profile_out))
+        if args.fast:  # 記録した入力をできるだけ速く再生する
+            seed, caps, inputs = read_replay(args.replay)
+            game = run_headless(None, seed, args.numpy, caps, profiler, inputs)
+        else:
+            game = run_headless(args.headless, args.seed, args.numpy, args.caps, profiler)
+        print_report(game, time.perf_counter()-start, profiler)
+        if args.profile_out:
+            profiler.dump(args.profile_out)
+        pg.quit()
+        sys.exit()
     pg.init()
-    main()
+    main(args)
     pg.quit()
     sys.exit()
@@ -0,0 +1,69 @@
+"""
+space_kokaton.pyの--telemetryで記録したファイルを読み込んで集計する
+ファイルはメモリマップしてNumPyの構造化配列として読むので，1時間分の記録でもすぐに開ける
+（配列はspace_kokaton.read_telemetryで取り出せるので，ノートブックなどでの分析にもそのまま使える）
+
+使い方（ゲームと同じく ex05 の親ディレクトリで実行する）：
+    python ex05/space_kokaton.py --telemetry run.tel     # 遊びながら記録する
+    python ex05/telemetry_kokaton.py run.tel              # 集計を表示する
+    python ex05/telemetry_kokaton.py run.tel --csv run.csv
+"""
+import argparse
+import csv
+import sys
+
+import numpy as np
+
+import space_kokaton as sk
+
+
+def summarize(records: np.ndarray) -> dict:
+    """
+    レコードの配列を集計する
+    引数 records：read_telemetryで読み込んだレコードの配列
+    戻り値：ステップ数，記録時間，フレーム時間のパーセンタイル，最大数などの辞書
+    """
+    frame_ms = records["frame_ms"]
+    return {
+        "steps": len(records),
+        "seconds": float(records["time"][-1]-records["time"][0]),
+        "frame_p50": float(np.percentile(frame_ms, 50)),
+        "frame_p95": float(np.percentile(frame_ms, 95)),
+        "frame_p99": float(np.percentile(frame_ms, 99)),
+        "frame_max": float(frame_ms.max()),
+        "max_bombs": int(records["num_bombs"].max()),
+        "max_beams": int(records["num_beams"].max()),
+        "max_emys": int(records["num_emys"].max()),
+        "min_hp": int(records["hp"].min()),
+        "max_score": int(records["score"].max()),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="逆襲！エイリアン テレメトリの集計")
+    parser.add_argument("path", help="--telemetryで記録したファイル")
+    parser.add_argument("--csv", default=None, metavar="PATH", help="位置以外の項目をステップごとにCSVで書き出す")
+    args = parser.parse_args()
+
+    header, records = sk.read_telemetry(args.path)
+    wrapped = "（古いものは上書き済み）" if header["count"] > header["capacity"] else ""
+    print(f"乱数の種 {header['seed']}，{len(records)}/{header['count']}ステップ{wrapped}")
+    if not len(records):
+        return 0
+    summary = summarize(records)
+    print(f"{summary['seconds']:.1f}秒  frame p50 {summary['frame_p50']:.2f}  p95 {summary['frame_p95']:.2f}  "
+          f"p99 {summary['frame_p99']:.2f}  max {summary['frame_max']:.2f} ms")
+    print(f"最大数 bombs {summary['max_bombs']}  beams {summary['max_beams']}  emys {summary['max_emys']}  "
+          f"最小HP {summary['min_hp']}  最高スコア {summary['max_score']}")
+
+    if args.csv:
+        names = [name for name in records.dtype.names if records.dtype[name].shape == ()]
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(names)
+            writer.writerows(zip(*(records[name].tolist() for name in names)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())